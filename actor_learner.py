@@ -0,0 +1,286 @@
+import multiprocessing as mp
+import queue
+import random
+import time
+from typing import Any, Dict
+
+import numpy as np
+import torch
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from agent import GameAgent
+from utils import ProgressPlotter
+
+
+class TransitionQueue:
+    # single producer, single consumer ring of transitions living in shared memory
+
+    def __init__(self, capacity: int, state_size: int, state_dtype, ctx=mp):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.state_dtype = np.dtype(state_dtype)
+
+        state_bytes = capacity*state_size*self.state_dtype.itemsize
+        self._buffers = (
+            ctx.RawArray('b', state_bytes),
+            ctx.RawArray('b', state_bytes),
+            ctx.RawArray('B', capacity),
+            ctx.RawArray('f', capacity),
+            ctx.RawArray('B', capacity),
+        )
+        self.written = ctx.Value('q', 0)
+        self.read = ctx.Value('q', 0)
+        self._attach()
+
+    def _attach(self) -> None:
+        states, next_states, actions, rewards, game_overs = self._buffers
+        shape = (self.capacity, self.state_size)
+        self.states = np.frombuffer(states, dtype=self.state_dtype).reshape(shape)
+        self.next_states = np.frombuffer(next_states, dtype=self.state_dtype).reshape(shape)
+        self.actions = np.frombuffer(actions, dtype=np.uint8)
+        self.rewards = np.frombuffer(rewards, dtype=np.float32)
+        self.game_overs = np.frombuffer(game_overs, dtype=np.bool_)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('states', 'next_states', 'actions', 'rewards', 'game_overs'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def put(self, state, action: int, reward: float, next_state, game_over: bool, stop=None) -> bool:
+        written = self.written.value
+        while written - self.read.value >= self.capacity:
+            if stop is not None and stop.is_set():
+                return False
+            time.sleep(0.001)
+
+        pos = written % self.capacity
+        self.states[pos] = state
+        self.actions[pos] = action
+        self.rewards[pos] = reward
+        self.next_states[pos] = next_state
+        self.game_overs[pos] = game_over
+        with self.written.get_lock():
+            self.written.value = written + 1
+        return True
+
+    def drain(self, memory) -> int:
+        read, written = self.read.value, self.written.value
+        n = written - read
+        if n:
+            idxs = np.arange(read, written) % self.capacity
+            memory.extend(
+                self.states[idxs], self.actions[idxs], self.rewards[idxs],
+                self.next_states[idxs], self.game_overs[idxs]
+            )
+            with self.read.get_lock():
+                self.read.value = written
+        return n
+
+
+class SharedWeights:
+    # the latest model parameters published by the learner, flattened into shared memory
+
+    def __init__(self, model: torch.nn.Module, ctx=mp):
+        n_params = sum(p.numel() for p in model.parameters())
+        self._buffer = ctx.RawArray('f', n_params)
+        self.version = ctx.Value('q', 0)
+        self.publish(model)
+
+    @property
+    def vector(self) -> np.ndarray:
+        return np.frombuffer(self._buffer, dtype=np.float32)
+
+    def publish(self, model: torch.nn.Module) -> None:
+        with self.version.get_lock():
+            self.vector[:] = parameters_to_vector(model.parameters()).detach().numpy()
+            self.version.value += 1
+
+    def pull(self, model: torch.nn.Module) -> int:
+        with self.version.get_lock():
+            vector = torch.from_numpy(self.vector.copy())
+            version = self.version.value
+        vector_to_parameters(vector, model.parameters())
+        return version
+
+
+def run_actor(
+    worker_id: int,
+    game,
+    transitions: TransitionQueue,
+    weights: SharedWeights,
+    scores,
+    stop,
+    ready,
+    train_params: Dict[str, Any],
+    max_steps: float,
+    sync_every: int,
+    seed: int
+    ) -> None:
+
+    torch.set_num_threads(1)
+    if seed is not None:
+        random.seed(seed + worker_id)
+        np.random.seed(seed + worker_id)
+        torch.manual_seed(seed + worker_id)
+
+    game.set_map_actions()
+    agent = GameAgent(game, **{**train_params, 'max_memory': 1})
+    version = weights.pull(agent.model)
+    with ready.get_lock():
+        ready.value += 1
+
+    step_counter = 0
+    total_steps = 0
+    try:
+        while not stop.is_set():
+            if total_steps % sync_every == 0 and weights.version.value != version:
+                version = weights.pull(agent.model)
+
+            old_state = agent.get_state()
+            action = agent.act(old_state)
+            reward, game_over, score = game.play_step(action)
+            new_state = agent.get_state()
+            if not transitions.put(old_state, action, reward, new_state, game_over, stop):
+                break
+
+            step_counter += 1
+            total_steps += 1
+            if game_over or step_counter >= max_steps:
+                game.reset(train=True)
+                agent.n_games += 1
+                scores.put((worker_id, score))
+                step_counter = 0
+    except KeyboardInterrupt:
+        pass
+
+
+def train_parallel(
+    game,
+    n_workers: int = None,
+    plot: bool = False,
+    max_games: int = 10_000,
+    max_steps: int = None,
+    max_seconds: float = None,
+    model_filename: str = None,
+    train_params: Dict[str, Any] = {},
+    sync_every: int = 100,
+    steps_per_update: int = 4,
+    queue_size: int = 10_000,
+    report_every: float = 5.,
+    seed: int = None
+    ) -> Dict[str, Any]:
+
+    if n_workers is None:
+        n_workers = max(1, mp.cpu_count() - 1)
+    if max_steps is None:
+        max_steps = np.inf
+    if max_games is None:
+        max_games = np.inf
+    if max_seconds is None:
+        max_seconds = np.inf
+
+    ctx = mp.get_context('spawn')
+    game.set_map_actions()
+    learner = GameAgent(game, **train_params)
+
+    weights = SharedWeights(learner.model, ctx)
+    stop = ctx.Event()
+    ready = ctx.Value('i', 0)
+    scores_queue = ctx.Queue()
+    transitions = [
+        TransitionQueue(queue_size, game.state_size, game.STATE_DTYPE, ctx)
+        for _ in range(n_workers)
+    ]
+    workers = [
+        ctx.Process(
+            target=run_actor,
+            args=(i, game, transitions[i], weights, scores_queue, stop, ready, train_params, max_steps, sync_every, seed),
+            daemon=True
+        )
+        for i in range(n_workers)
+    ]
+
+    plotter = ProgressPlotter() if plot else None
+
+    scores = []
+    mean_scores = []
+    total_score = 0
+    record = 0
+    updates = 0
+    env_steps = 0
+
+    try:
+        for worker in workers:
+            worker.start()
+        while ready.value < n_workers and all(worker.is_alive() for worker in workers):
+            time.sleep(0.01)
+
+        start = last_report = time.perf_counter()
+        last_steps = last_updates = 0
+        while len(scores) < max_games and time.perf_counter() - start < max_seconds:
+            drained = sum(t.drain(learner.memory) for t in transitions)
+            env_steps += drained
+
+            # keep the learner at one update per steps_per_update env steps so it does not starve the actors
+            if len(learner.memory) >= learner.batch_size and updates*steps_per_update < env_steps:
+                learner.train_long_memory()
+                updates += 1
+                if updates % sync_every == 0:
+                    weights.publish(learner.model)
+            elif not drained:
+                time.sleep(0.001)
+
+            while True:
+                try:
+                    _, score = scores_queue.get_nowait()
+                except queue.Empty:
+                    break
+                learner.n_games += 1
+                if score > record:
+                    record = score
+                    if model_filename:
+                        learner.model.save(model_filename)
+                scores.append(score)
+                total_score += score
+                mean_scores.append(total_score / learner.n_games)
+                if plot:
+                    plotter.push(score, mean_scores[-1])
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                if not all(worker.is_alive() for worker in workers):
+                    raise RuntimeError("An actor process exited unexpectedly")
+                print(
+                    'Games', learner.n_games, 'Record:', record,
+                    'Mean Score:', mean_scores[-1] if mean_scores else 0,
+                    'env steps/sec', round((env_steps - last_steps)/(now - last_report), 1),
+                    'updates/sec', round((updates - last_updates)/(now - last_report), 1)
+                )
+                last_report, last_steps, last_updates = now, env_steps, updates
+    finally:
+        if plotter:
+            plotter.close()
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        scores_queue.cancel_join_thread()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'games': learner.n_games,
+        'record': record,
+        'mean_score': mean_scores[-1] if mean_scores else 0,
+        'env_steps': env_steps,
+        'updates': updates,
+        'env_steps_per_sec': env_steps/elapsed,
+        'updates_per_sec': updates/elapsed,
+        'agent': learner,
+    }
@@ -1,13 +1,10 @@
 import random
 import time
-from collections import deque
 
 import torch 
-import matplotlib.pyplot as plt
 
-from model import DQN, DQNTrainer
-
-plt.style.use("dark_background")
+from model import ConvDQN, DQN, DQNTrainer, InferencePolicy, model_from_state_dict
+from replay import PackedReplayBuffer, PrioritizedReplayBuffer, ReplayBuffer
 
 MAX_MEMORY = 100_000
 BATCH_SIZE = 1000
@@ -26,51 +23,138 @@ class GameAgent:
         lr=LR, 
         max_memory=MAX_MEMORY, 
         batch_size=BATCH_SIZE,
-        max_eps_games=MAX_EPS_GAMES):
+        max_eps_games=MAX_EPS_GAMES,
+        train_every=None,
+        gradient_steps=1,
+        target_update=None,
+        tau=None,
+        double=False,
+        prioritized=False,
+        alpha=0.6,
+        beta=0.4):
 
         self.game = game
         self.n_games = 0
-        self.memory = deque(maxlen=MAX_MEMORY)
+        self.state_size = self.game.state_size
+        self.max_memory = max_memory
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.memory = self.make_memory()
 
-        self.model = DQN(self.game.state_size, hidden_size, self.game.action_size)
-        self.trainer = DQNTrainer(self.model, lr, gamma)
+        if self.game.STATE_SHAPE:
+            self.model = ConvDQN(self.game.STATE_SHAPE, hidden_size, self.game.action_size)
+        else:
+            self.model = DQN(self.state_size, hidden_size, self.game.action_size)
+        self.action_idxs = [torch.tensor([idx]) for idx in range(self.game.action_size)]
+        self.trainer = DQNTrainer(self.model, lr, gamma, target_update, tau, double)
         
         self.eps = eps
-        self.max_memory = max_memory
         self.batch_size = batch_size
         self.max_eps_games = max_eps_games
 
+        # None keeps the original schedule, a single-transition update every step and a replay batch
+        # per game. Otherwise gradient_steps replay batches every train_every steps, once the replay
+        # holds a batch.
+        self.train_every = train_every
+        self.gradient_steps = gradient_steps
+        self.steps = 0
+
+
+    def make_memory(self):
+        if self.prioritized:
+            return PrioritizedReplayBuffer(self.max_memory, self.state_size, self.game.STATE_DTYPE, self.alpha, self.beta)
+        if self.game.STATE_SHAPE:
+            # board planes are mostly zeros and change in a few cells per step
+            return PackedReplayBuffer(self.max_memory, self.state_size)
+        return ReplayBuffer(self.max_memory, self.state_size, self.game.STATE_DTYPE)
 
     def get_state(self):
-        return torch.tensor(self.game.get_state(), dtype=torch.float)
+        # models with fewer inputs than the game offers see the leading features only,
+        # e.g. the 12-feature checkpoints in model/ against today's 16-feature Snake state
+        state = torch.empty(self.state_size)
+        self.game.write_state(state.numpy())
+        return state
 
     def remember(self, state, action, reward, next_state, game_over):
-        self.memory.append((state, action, reward, next_state, game_over))
+        self.memory.append(state, self.game.action_index(action), reward, next_state, game_over)
 
     def train_long_memory(self):
-        if len(self.memory) > self.batch_size:
-            mini_sample = random.sample(self.memory, self.batch_size)
-        else:
-            mini_sample = self.memory
-        
-        states, actions, rewards, next_states, game_overs = zip(*mini_sample)
-        self.trainer.train_step(states, actions, rewards, next_states, game_overs)
+        if not self.prioritized:
+            return self.trainer.update(*self.memory.sample(self.batch_size))
+        idxs = self.memory.sample_idxs(self.batch_size)
+        loss = self.trainer.update(*self.memory.get(idxs), weights=self.memory.weights(idxs))
+        self.memory.update_priorities(idxs, self.trainer.td_errors)
+        return loss
+
+    def train_scheduled(self):
+        self.steps += 1
+        loss = None
+        if self.steps % self.train_every == 0 and len(self.memory) >= self.batch_size:
+            for _ in range(self.gradient_steps):
+                loss = self.train_long_memory()
+        return loss
 
     def train_short_memory(self, state, action, reward, next_state, game_over):
-        self.trainer.train_step(state, action, reward, next_state, game_over)
+        if type(action) is not int:
+            return self.trainer.train_step(state, action, reward, next_state, game_over)
+        return self.trainer.update(
+            state.unsqueeze(0),
+            self.action_idxs[action],
+            torch.tensor([reward], dtype=torch.float),
+            next_state.unsqueeze(0),
+            torch.tensor([game_over])
+        )
+
+    def act(self, state):
+        if random.random() < self.eps*(self.max_eps_games-self.n_games)/self.max_eps_games:
+            return random.randrange(self.game.action_size)
+        with torch.inference_mode():
+            return self.model(state).argmax().item()
 
     def get_action(self, state):
+        # one-hot version of act
         final_move = [0]*self.game.action_size
-        if random.random() < self.eps*(self.max_eps_games-self.n_games)/self.max_eps_games:
-            final_move = random.choice(self.game.action_space)
-        else:
-            idx = self.model(state).argmax().item()
-            final_move[idx] = 1
-
+        final_move[self.act(state)] = 1
         return final_move
 
     def save(self, path):
         torch.save(self.model.state_dict(), path)
 
+    def checkpoint(self, path):
+        # everything needed to resume training, unlike save which keeps the model weights only
+        torch.save({
+            'model': self.model.state_dict(),
+            'optimizer': self.trainer.optimizer.state_dict(),
+            'target_model': self.trainer.target_model.state_dict() if self.trainer.target_model else None,
+            'updates': self.trainer.updates,
+            'n_games': self.n_games,
+            'steps': self.steps,
+            'memory': self.memory,
+        }, path)
+
+    def restore(self, path):
+        # the agent must have been built with the same parameters as the checkpointed one
+        state = torch.load(path, weights_only=False)
+        self.model.load_state_dict(state['model'])
+        self.trainer.optimizer.load_state_dict(state['optimizer'])
+        if state['target_model'] is not None:
+            self.trainer.target_model.load_state_dict(state['target_model'])
+        self.trainer.updates = state['updates']
+        self.n_games = state['n_games']
+        self.steps = state['steps']
+        self.memory = state['memory']
+
     def load(self, path):
-        self.model.load_state_dict(torch.load(path))
+        self.model = model_from_state_dict(torch.load(path))
+        trainer = self.trainer
+        self.trainer = DQNTrainer(self.model, trainer.lr, trainer.gamma, trainer.target_update, trainer.tau, trainer.double)
+        if self.model.input_size != self.state_size:
+            self.state_size = self.model.input_size
+            self.memory = self.make_memory()
+
+    def policy(self, backend=None, memoize=False):
+        # numpy by default, which only runs the fully connected DQN
+        if backend is None:
+            backend = 'numpy' if isinstance(self.model, DQN) else 'torch'
+        return InferencePolicy(self.model, backend, memoize)
@@ -0,0 +1,237 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class BatchedSnake:
+    # N independent Snake games stepped in lockstep on numpy arrays.
+    # Directions are indexed in get_state order: up, down, left, right.
+    # Actions are indices into Snake.ACTION_MAP: 0 turn left, 1 turn right, 2 keep going.
+
+    MOVES = np.array([
+        [0, -1],
+        [0, 1],
+        [-1, 0],
+        [1, 0]
+    ])
+
+    # TURNS[direction, action] -> new direction, same table as Snake.MAPPING
+    TURNS = np.array([
+        [2, 3, 0],
+        [3, 2, 1],
+        [1, 0, 2],
+        [0, 1, 3]
+    ])
+
+    # (dx, dy) of up, down, left, right at distance one, then at distance two
+    DANGER_OFFSETS = np.array([
+        [0, 0, -1, 1, 0, 0, -2, 2],
+        [-1, 1, 0, 0, -2, 2, 0, 0]
+    ])
+
+    state_size = 16
+    action_size = 3
+
+    def __init__(
+        self,
+        n_games: int,
+        grid_wh: Tuple[int, int],
+        x0: int,
+        y0: int,
+        initial_length: int = 3,
+        walls: bool = True,
+        train: bool = True,
+        max_steps: int = None,
+        seed: int = None
+        ):
+
+        width, height = grid_wh
+        if initial_length > width:
+            raise ValueError("Initial length is greater than grid width")
+
+        self.n_games = n_games
+        self.width = width
+        self.height = height
+        self.walls = walls
+        self.train = train
+        self.max_steps = max_steps
+        self.x0, self.y0 = x0, y0
+        self.initial_length = initial_length
+        self.rng = np.random.RandomState(seed)
+
+        n_cells = width*height
+        # the body can hold one off-grid segment per initial cell plus one per food eaten
+        self.capacity = n_cells + width + 1
+
+        # ring buffer of flat cell ids from tail to head, -1 marks segments outside the grid
+        self.body = np.full((n_games, self.capacity), -1, dtype=np.int32)
+        self.tail = np.zeros(n_games, dtype=np.int64)
+        self.length = np.zeros(n_games, dtype=np.int64)
+
+        self.occupancy = np.zeros((n_games, height, width), dtype=np.uint8)
+        self.eating = np.zeros((n_games, height, width), dtype=np.uint8)
+        self._occupancy = self.occupancy.reshape(n_games, n_cells)
+        self._eating = self.eating.reshape(n_games, n_cells)
+
+        self.head_x = np.zeros(n_games, dtype=np.int64)
+        self.head_y = np.zeros(n_games, dtype=np.int64)
+        self.direction = np.zeros(n_games, dtype=np.int64)
+        self.food = np.full(n_games, -1, dtype=np.int64)
+        self.scores = np.zeros(n_games, dtype=np.int64)
+        self.steps = np.zeros(n_games, dtype=np.int64)
+
+        self._games = np.arange(n_games)
+        self._cell_offsets = self._games[:, None]*n_cells
+
+        # flat cell id -> its eight danger cells, wrapped around the board like Snake.get_state does
+        ys, xs = np.divmod(np.arange(n_cells)[:, None], width)
+        self._danger_cells = (
+            ((ys + self.DANGER_OFFSETS[1]) % height)*width
+            + (xs + self.DANGER_OFFSETS[0]) % width
+        )
+        self.reset(np.ones(n_games, dtype=bool), train=False)
+
+    def reset(self, mask: np.ndarray = None, train: bool = None) -> None:
+        if mask is None:
+            mask = np.ones(self.n_games, dtype=bool)
+        train = self.train if train is None else train
+        games = self._games[mask]
+        n = len(games)
+        if not n:
+            return
+
+        if train:
+            lengths = self.rng.randint(3, self.width, size=n)
+            if self.walls:
+                lengths = np.where(lengths > 4, lengths//2, lengths)
+        else:
+            lengths = np.full(n, self.initial_length)
+
+        # same layout as Snake.initialize_body: a horizontal line ending on (x0, y0)
+        segment = np.arange(lengths.max())
+        xs = self.x0 - (lengths[:, None] - 1 - segment)
+        valid = segment < lengths[:, None]
+        on_grid = valid & (xs >= 0) & (xs < self.width) & (0 <= self.y0 < self.height)
+        cells = np.where(on_grid, self.y0*self.width + xs, -1)
+
+        self.body[games] = -1
+        self.body[games, :cells.shape[1]] = cells
+        self.tail[games] = 0
+        self.length[games] = lengths
+
+        self._occupancy[games] = 0
+        self._eating[games] = 0
+        rows, cols = np.nonzero(on_grid)
+        self._occupancy[games[rows], cells[rows, cols]] = 1
+
+        self.head_x[games] = self.x0
+        self.head_y[games] = self.y0
+        self.direction[games] = 3
+        self.food[games] = -1
+        self.scores[games] = 0
+        self.steps[games] = 0
+
+    def update_food(self) -> None:
+        games = self._games[self.food < 0]
+        while len(games):
+            cells = self.rng.randint(0, self.width*self.height, size=len(games))
+            free = self._occupancy[games, cells] == 0
+            self.food[games[free]] = cells[free]
+            games = games[~free]
+
+            # nearly full boards: pick directly among the free cells, or go without food
+            if len(games) and not free.any():
+                for game in games:
+                    free_cells = np.flatnonzero(self._occupancy[game] == 0)
+                    if len(free_cells):
+                        self.food[game] = self.rng.choice(free_cells)
+                break
+
+    def update_body(self) -> Tuple[np.ndarray, np.ndarray]:
+        games = self._games
+        capacity = self.capacity
+
+        tail_cells = self.body[games, self.tail]
+        on_grid = tail_cells >= 0
+        self._occupancy[games[on_grid], tail_cells[on_grid]] -= 1
+
+        # a tail leaving a cell where food was eaten leaves a duplicate segment behind, as Snake does
+        growing = on_grid.copy()
+        growing[on_grid] = self._eating[games[on_grid], tail_cells[on_grid]] > 0
+        grow = games[growing]
+        self._eating[grow, tail_cells[growing]] -= 1
+
+        old_tails = self.tail[grow]
+        self.tail += 1
+        self.tail[self.tail == capacity] = 0
+        new_tails = self.body[grow, self.tail[grow]]
+        self.body[grow, old_tails] = new_tails
+        self.tail[grow] = old_tails
+        kept = new_tails >= 0
+        self._occupancy[grow[kept], new_tails[kept]] += 1
+        self.length += growing - 1
+
+        moves = self.MOVES[self.direction]
+        head_x = self.head_x + moves[:, 0]
+        head_y = self.head_y + moves[:, 1]
+        if self.walls:
+            off_grid = (head_x < 0) | (head_x >= self.width) | (head_y < 0) | (head_y >= self.height)
+        else:
+            head_x %= self.width
+            head_y %= self.height
+            off_grid = np.zeros(self.n_games, dtype=bool)
+        self.head_x, self.head_y = head_x, head_y
+
+        head_cells = np.where(off_grid, -1, head_y*self.width + head_x)
+        heads = self.tail + self.length
+        heads[heads >= capacity] -= capacity
+        self.body[games, heads] = head_cells
+        self.length += 1
+
+        on_grid = ~off_grid
+        self._occupancy[games[on_grid], head_cells[on_grid]] += 1
+
+        dead = off_grid.copy()
+        dead[on_grid] = self._occupancy[games[on_grid], head_cells[on_grid]] > 1
+
+        ate = on_grid & (head_cells == self.food)
+        self.scores += ate
+        self._eating[games[ate], head_cells[ate]] += 1
+        self.food[ate] = -1
+
+        return dead, ate
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        self.direction = self.TURNS[self.direction, actions]
+        self.update_food()
+        dead, ate = self.update_body()
+        self.steps += 1
+
+        rewards = np.where(dead, -10., np.where(ate, 10., -0.05))
+        scores = self.scores.copy()
+
+        # games cut at max_steps are done too, they restart like the dead ones and only the -10 reward tells
+        # the two apart, so that a next state is never the first state of another game without a done flag
+        dones = dead
+        if self.max_steps is not None:
+            dones = dead | (self.steps >= self.max_steps)
+        self.reset(dones)
+
+        return self.get_state(), rewards, dones, scores
+
+    def get_state(self) -> np.ndarray:
+        state = np.zeros((self.n_games, self.state_size), dtype=np.float32)
+        state[self._games, self.direction] = 1
+
+        has_food = self.food >= 0
+        food_x = self.food % self.width
+        food_y = self.food // self.width
+        state[:, 4] = has_food & (self.head_y > food_y)
+        state[:, 5] = has_food & (self.head_y < food_y)
+        state[:, 6] = has_food & (self.head_x > food_x)
+        state[:, 7] = has_food & (self.head_x < food_x)
+
+        cells = self._cell_offsets + self._danger_cells[self.head_y*self.width + self.head_x]
+        state[:, 8:] = self.occupancy.ravel()[cells] > 0
+
+        return state
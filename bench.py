@@ -0,0 +1,621 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+from agent import GameAgent
+from game import GameGrid, Watcher
+from model import ConvDQN, DQN, DQNTrainer, InferencePolicy
+from replay import PackedReplayBuffer, PrioritizedReplayBuffer, ReplayBuffer
+from snake import Snake
+
+
+class LoopedDQNTrainer(DQNTrainer):
+    # the per-sample Q-target loop DQNTrainer used before batching, kept as a baseline
+    def update(self, states, action_idxs, rewards, next_states, game_overs):
+        pred = self.model(states)
+        target = pred.clone()
+        for idx in range(len(game_overs)):
+            Q_new = rewards[idx]
+            if not game_overs[idx]:
+                Q_new = rewards[idx] + self.gamma * torch.max(self.model(next_states[idx]))
+            target[idx][action_idxs[idx].item()] = Q_new
+
+        self.optimizer.zero_grad()
+        loss = self.loss_fn(target, pred)
+        loss.backward()
+        self.optimizer.step()
+        return loss.item()
+
+
+class BootstrapGradDQNTrainer(DQNTrainer):
+    # the batched update used before target networks, bootstrapping from self.model with gradients
+    # flowing through the target, kept as a baseline
+    def update(self, states, action_idxs, rewards, next_states, game_overs):
+        pred = self.model(states)
+        Q_new = torch.where(game_overs, rewards, rewards + self.gamma * self.model(next_states).max(dim=1).values)
+        target = pred.clone()
+        target.scatter_(1, action_idxs.unsqueeze(1), Q_new.unsqueeze(1))
+
+        self.optimizer.zero_grad()
+        loss = self.loss_fn(target, pred)
+        loss.backward()
+        self.optimizer.step()
+        return loss.item()
+
+
+class FullRedrawGameGrid(GameGrid):
+    # the clear-and-redraw-everything GameGrid.print used before diff rendering, kept as a baseline
+    def print(self, game, stream=None):
+        self.grid = np.full((self.height, self.width), ' ')
+        game.update_grid()
+
+        game_grid = "\033c" + game.HEADER + '\n\r\n'
+        game_grid += '  ' + "# "*self.width + '\n\r'
+        for j in range(self.height):
+            game_grid += '# '
+            for i in range(self.width):
+                game_grid += self.grid[j, i] + ' '
+            game_grid += '#\n\r'
+        game_grid += '  ' + "# "*self.width + '\n\r'
+        stream.write(game_grid + '\n')
+
+
+class NullStream:
+    def __init__(self):
+        self.bytes_written = 0
+        self.writes = 0
+
+    def write(self, text):
+        self.bytes_written += len(text.encode())
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+def random_batch(batch_size, state_size=16, action_size=3):
+    states = torch.randint(0, 2, (batch_size, state_size)).float()
+    next_states = torch.randint(0, 2, (batch_size, state_size)).float()
+    action_idxs = torch.randint(0, action_size, (batch_size,))
+    rewards = torch.randn(batch_size)
+    game_overs = torch.rand(batch_size) < 0.1
+    return states, action_idxs, rewards, next_states, game_overs
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def run_for(fn, min_time):
+    # calls fn until min_time seconds have passed, returns (calls, elapsed)
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls, elapsed
+
+
+def make_snake(grid_wh, initial_length, walls=False):
+    game = Snake(grid_wh, grid_wh[0]//2, grid_wh[1]//2, initial_length, walls=walls)
+    game.set_map_actions()
+    return game
+
+
+def bench_play_step(grid_sizes=(20, 100, 500), lengths=(3, 0.5), min_time=0.5, seed=0):
+    # lengths below 1 are fractions of the grid width
+    results = []
+    for size in grid_sizes:
+        for length in lengths:
+            initial_length = int(length*size) if length < 1 else length
+            seed_everything(seed)
+            game = make_snake((size, size), initial_length)
+            action_size = game.action_size
+
+            def step():
+                if game.play_step(random.randrange(action_size))[1]:
+                    game.reset()
+
+            calls, elapsed = run_for(step, min_time)
+            results.append({
+                'grid_wh': [size, size],
+                'initial_length': initial_length,
+                'steps_per_sec': calls/elapsed,
+                'us_per_step': 1e6*elapsed/calls,
+            })
+    return results
+
+
+def bench_get_state(grid_sizes=(20, 500), initial_length=10, min_time=0.5, seed=0):
+    results = []
+    for size in grid_sizes:
+        seed_everything(seed)
+        game = make_snake((size, size), initial_length)
+        game.play_step(2)
+        calls, elapsed = run_for(game.get_state, min_time)
+        results.append({
+            'grid_wh': [size, size],
+            'us_per_call': 1e6*elapsed/calls,
+        })
+    return results
+
+
+def bench_get_action(hidden_sizes=(256,), min_time=0.5, seed=0):
+    results = []
+    for hidden_size in hidden_sizes:
+        seed_everything(seed)
+        game = make_snake((20, 20), 3)
+        agent = GameAgent(game, hidden_size=hidden_size, eps=0)
+        state = agent.get_state()
+        calls, elapsed = run_for(lambda: agent.act(state), min_time)
+        results.append({
+            'path': 'GameAgent.act',
+            'hidden_size': hidden_size,
+            'us_per_action': 1e6*elapsed/calls,
+        })
+
+        # the inference path watch_agent_play uses, fed from Snake.get_state
+        for backend in InferencePolicy.BACKENDS:
+            for memoize in (False, True):
+                policy = agent.policy(backend, memoize)
+                states = [game.get_state()]
+                for _ in range(63):
+                    game.play_step(policy.act(states[-1]))
+                    states.append(game.get_state())
+                cycle = itertools.cycle(states)
+                calls, elapsed = run_for(lambda: policy.act(next(cycle)), min_time)
+                results.append({
+                    'path': f'InferencePolicy[{backend}{", memoize" if memoize else ""}]',
+                    'hidden_size': hidden_size,
+                    'us_per_action': 1e6*elapsed/calls,
+                })
+    return results
+
+
+def bench_train_step(batch_sizes=(1, 32, 256, 1000), min_time=1.0, hidden_size=256, seed=0, baseline=True):
+    results = []
+    for trainer_cls in ((LoopedDQNTrainer, DQNTrainer) if baseline else (DQNTrainer,)):
+        for batch_size in batch_sizes:
+            seed_everything(seed)
+            trainer = trainer_cls(DQN(16, hidden_size, 3), lr=0.001, gamma=0.9)
+            batch = random_batch(batch_size)
+            trainer.update(*batch)
+
+            calls, elapsed = run_for(lambda: trainer.update(*batch), min_time)
+            results.append({
+                'trainer': trainer_cls.__name__,
+                'batch_size': batch_size,
+                'updates_per_sec': calls/elapsed,
+            })
+    return results
+
+
+# builds a Snake and its viewport GameGrid in a fresh interpreter, which only imports numpy, and prints the
+# construction time, the resident memory it added (Linux only) and the step time
+SNAKE_FOOTPRINT = '''
+import json, os, random, sys, time
+import numpy as np
+from game import GameGrid
+from snake import Snake
+width, height, initial_length, viewport, n_steps, seed = json.loads(sys.argv[1])
+random.seed(seed)
+np.random.seed(seed)
+def rss():
+    if not os.path.exists('/proc/self/statm'):
+        return None
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+rss_before = rss()
+start = time.perf_counter()
+game = Snake((width, height), width//2, height//2, initial_length, walls=False)
+game.grid = GameGrid(width, height, viewport=viewport)
+construct = time.perf_counter() - start
+rss_mb = (rss() - rss_before)/2**20 if rss_before is not None else None
+game.set_map_actions()
+actions = [random.randrange(game.action_size) for _ in range(n_steps)]
+start = time.perf_counter()
+for action in actions:
+    if game.play_step(action)[1]:
+        game.reset()
+step = time.perf_counter() - start
+print(json.dumps({'construct_ms': 1000*construct, 'rss_mb': rss_mb, 'us_per_step': 1e6*step/n_steps}))
+'''
+
+
+def snake_footprint(grid_wh, initial_length, viewport, n_steps, seed):
+    process = subprocess.run(
+        [sys.executable, '-c', SNAKE_FOOTPRINT, json.dumps([*grid_wh, initial_length, viewport, n_steps, seed])],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return json.loads(process.stdout)
+
+
+def bench_render(grid_sizes=(100, 1000), initial_length=50, n_frames=300, viewport=(60, 30), n_steps=100_000, seed=0, baseline=True):
+    # the full redraw baseline builds every cell's string each frame, so it is skipped past 250k cells.
+    # A Snake row per size, and one for 20x20 to compare with, gives what the game itself costs on the board
+    results = []
+    for size in (20, *grid_sizes):
+        results.append({
+            'renderer': None,
+            'game': 'Snake',
+            'grid_wh': [size, size],
+            **snake_footprint((size, size), min(initial_length, size), viewport, n_steps, seed),
+        })
+    for size in grid_sizes:
+        grid_wh = (size, size)
+        variants = [
+            ('GameGrid[dense]', GameGrid, False, None),
+            ('GameGrid[sparse]', GameGrid, True, None),
+            ('GameGrid[sparse, viewport]', GameGrid, True, viewport),
+        ]
+        if baseline and size*size <= 250_000:
+            variants.insert(0, ('FullRedrawGameGrid', FullRedrawGameGrid, False, None))
+
+        for name, grid_cls, sparse, view in variants:
+            seed_everything(seed)
+            game = make_snake(grid_wh, initial_length)
+            game.SPARSE_GRID = sparse
+            game.grid = grid_cls(*grid_wh) if view is None else grid_cls(*grid_wh, viewport=view)
+            stream = NullStream()
+
+            elapsed = 0
+            for _ in range(n_frames):
+                start = time.perf_counter()
+                game.grid.print(game, stream)
+                elapsed += time.perf_counter() - start
+                _, game_over, _ = game.play_step(random.randrange(game.action_size))
+                if game_over:
+                    game.reset()
+
+            grid = game.grid
+            grid_bytes = sum(a.nbytes for a in (grid._grid, grid.previous, grid.cells) if a is not None)
+            results.append({
+                'renderer': name,
+                'grid_wh': list(grid_wh),
+                'ms_per_frame': 1000*elapsed/n_frames,
+                'bytes_per_frame': stream.bytes_written/n_frames,
+                'writes_per_frame': stream.writes/n_frames,
+                'grid_bytes': grid_bytes,
+            })
+    return results
+
+
+def bench_replay_sample(capacity=1_000_000, batch_size=1000, min_time=0.5, seed=0):
+    results = []
+    for buffer_cls in (ReplayBuffer, PrioritizedReplayBuffer):
+        seed_everything(seed)
+        memory = buffer_cls(capacity, 16)
+        memory.extend(
+            np.random.randint(0, 2, (capacity, 16)), np.random.randint(0, 3, capacity),
+            np.random.randn(capacity).astype(np.float32), np.random.randint(0, 2, (capacity, 16)),
+            np.random.random_sample(capacity) < 0.1
+        )
+        if buffer_cls is PrioritizedReplayBuffer:
+            memory.update_priorities(np.arange(capacity), np.random.exponential(size=capacity))
+
+            def sample():
+                idxs = memory.sample_idxs(batch_size)
+                memory.get(idxs), memory.weights(idxs)
+                memory.update_priorities(idxs, np.random.exponential(size=len(idxs)))
+        else:
+            def sample():
+                memory.sample(batch_size)
+
+        calls, elapsed = run_for(sample, min_time)
+        results.append({
+            'buffer': buffer_cls.__name__,
+            'capacity': capacity,
+            'batch_size': batch_size,
+            'ms_per_batch': 1000*elapsed/calls,
+        })
+    return results
+
+
+def bench_planes(grid_sizes=(20, 40), capacity=20_000, batch_size=256, min_time=0.5, seed=0):
+    # a play_step plus get_state with each observation, the replay memory a transition takes and a ConvDQN update
+    results = []
+    for size in grid_sizes:
+        for observation in Snake.OBSERVATIONS:
+            seed_everything(seed)
+            game = Snake((size, size), size//2, size//2, 3, walls=False, observation=observation)
+            game.set_map_actions()
+
+            def step():
+                if game.play_step(random.randrange(game.action_size))[1]:
+                    game.reset()
+                game.get_state()
+
+            calls, elapsed = run_for(step, min_time)
+            result = {
+                'observation': observation,
+                'grid_wh': [size, size],
+                'state_size': game.state_size,
+                'us_per_step': 1e6*elapsed/calls,
+            }
+            if observation == 'planes':
+                memory = PackedReplayBuffer(capacity, game.state_size)
+                state = game.get_state().copy()
+                while len(memory) < capacity:
+                    _, game_over, _ = game.play_step(random.randrange(game.action_size))
+                    next_state = game.get_state().copy()
+                    memory.append(state, 0, 0., next_state, game_over)
+                    if game_over:
+                        game.reset()
+                        next_state = game.get_state().copy()
+                    state = next_state
+                trainer = DQNTrainer(ConvDQN(game.STATE_SHAPE, 256, game.action_size), 0.001, 0.9)
+                calls, elapsed = run_for(lambda: trainer.update(*memory.sample(batch_size)), min_time)
+                result.update({
+                    'replay_bytes_per_transition': memory.nbytes/capacity,
+                    'unpacked_bytes_per_transition': 2*game.state_size,
+                    'ms_per_conv_update': 1000*elapsed/calls,
+                })
+            results.append(result)
+    return results
+
+
+def train_until(game, agent, target_score, window, max_seconds, max_steps):
+    # the TrainableGame.train loop without rendering, stopping once the mean score of the last window games reaches target_score
+    scores = deque(maxlen=window)
+    steps = step_counter = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < max_seconds:
+        old_state = agent.get_state()
+        action = agent.act(old_state)
+        reward, game_over, score = game.play_step(action)
+        new_state = agent.get_state()
+        if agent.train_every:
+            agent.remember(old_state, action, reward, new_state, game_over)
+            agent.train_scheduled()
+        else:
+            agent.train_short_memory(old_state, action, reward, new_state, game_over)
+            agent.remember(old_state, action, reward, new_state, game_over)
+
+        steps += 1
+        step_counter += 1
+        if game_over or step_counter >= max_steps:
+            game.reset(train=True)
+            agent.n_games += 1
+            if not agent.train_every:
+                agent.train_long_memory()
+            scores.append(score)
+            step_counter = 0
+            if len(scores) == window and np.mean(scores) >= target_score:
+                return True, time.perf_counter() - start, steps
+    return False, time.perf_counter() - start, steps
+
+
+# trainer setups compared by bench_time_to_score, 'baseline' is the schedule and trainer train() used before
+TRAINER_CONFIGS = {
+    'baseline': {},
+    'no_grad_bootstrap': {},
+    'target': {'train_every': 4, 'gradient_steps': 1, 'batch_size': 256, 'target_update': 250},
+    'double': {'train_every': 4, 'gradient_steps': 1, 'batch_size': 256, 'target_update': 250, 'double': True},
+    'polyak_double': {'train_every': 4, 'gradient_steps': 1, 'batch_size': 256, 'tau': 0.01, 'double': True},
+    'prioritized_double': {'train_every': 4, 'gradient_steps': 1, 'batch_size': 256, 'target_update': 250, 'double': True, 'prioritized': True},
+}
+
+
+def bench_time_to_score(
+    target_score=5, window=20, grid_wh=(10, 10), configs=tuple(TRAINER_CONFIGS), seeds=(0,),
+    max_seconds=120., max_steps=500, min_time=None, seed=0
+    ):
+    # wall-clock time until the mean score of the last window training games reaches target_score,
+    # min_time is accepted for --quick and shortens max_seconds
+    if min_time is not None:
+        max_seconds = 300*min_time
+    results = []
+    for name in configs:
+        for run_seed in seeds:
+            seed_everything(seed + run_seed)
+            game = make_snake(grid_wh, 3, walls=True)
+            agent = GameAgent(game, **TRAINER_CONFIGS[name])
+            if name == 'baseline':
+                agent.trainer = BootstrapGradDQNTrainer(agent.model, agent.trainer.lr, agent.trainer.gamma)
+            reached, elapsed, steps = train_until(game, agent, target_score, window, max_seconds, max_steps)
+            results.append({
+                'config': name,
+                'seed': seed + run_seed,
+                'target_score': target_score,
+                'reached': reached,
+                'seconds': elapsed,
+                'games': agent.n_games,
+                'env_steps': steps,
+                'env_steps_per_sec': steps/elapsed,
+            })
+    return results
+
+
+def bench_watch(grid_wh=(30, 30), initial_length=3, min_time=1.0, seed=0):
+    # steps per second of a watched game for each Watcher mode, drawn to a null stream without sleeping.
+    # Random turns on a walled 30x30 board end a game every 150 steps or so, so highlights replays get drawn
+    results = []
+    for mode, params in (('every', {}), ('skip', {'every': 10}), ('fps', {'fps': 30.}), ('highlights', {'highlights': 100})):
+        seed_everything(seed)
+        game = make_snake(grid_wh, initial_length, walls=True)
+        watcher = Watcher(game, mode, stream=NullStream(), **params)
+        games = 0
+
+        def step():
+            nonlocal games
+            watcher.frame()
+            if game.play_step(random.randrange(game.action_size))[1]:
+                watcher.game_over()
+                game.reset()
+                games += 1
+
+        calls, elapsed = run_for(step, min_time)
+        results.append({
+            'mode': mode,
+            'grid_wh': list(grid_wh),
+            'steps_per_sec': calls/elapsed,
+            'frames_per_step': watcher.frames/calls,
+            'games': games,
+            'steps_per_game': calls/games if games else None,
+        })
+    return results
+
+
+async def sleep_after_work_play(game, stream):
+    # Game.play before the TickScheduler, the baseline for bench_tick
+    while game.PLAY_CONDITION:
+        game.grid.print(game, stream)
+        game.update_game()
+        game.ticks += 1
+        await asyncio.sleep(1/game.UPDATE_PER_SECOND)
+
+
+def bench_tick(ups=(30, 120), grid_wh=(200, 100), seconds=3., key_every=0.05, min_time=None, seed=0):
+    # headless play at each ups with a key written to a pipe every key_every seconds, turning up and right
+    # in turn so that the snake never runs into itself. min_time is accepted for --quick and shortens seconds
+    if min_time is not None:
+        seconds = 10*min_time
+    results = []
+    for rate in ups:
+        for loop_name in ('scheduler', 'sleep_after_work'):
+            seed_everything(seed)
+            game = Snake(grid_wh, 3, grid_wh[1]//2, 3, ups=rate, walls=False)
+            game.ticks = 0
+            stream = NullStream()
+            read_fd, write_fd = os.pipe()
+            keys = itertools.cycle('wd')
+
+            async def run():
+                loop = asyncio.get_running_loop()
+
+                def press():
+                    if game.PLAY_CONDITION:
+                        os.write(write_fd, next(keys).encode())
+                        loop.call_later(key_every, press)
+
+                loop.call_later(seconds, setattr, game, 'PLAY_CONDITION', False)
+                press()
+                if loop_name == 'scheduler':
+                    await game.main_loop(stream, read_fd)
+                else:
+                    await sleep_after_work_play(game, stream)
+
+            start = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            os.close(read_fd)
+            os.close(write_fd)
+
+            if loop_name == 'scheduler':
+                stats = game.scheduler.stats()
+                result = {k: stats[k] for k in ('ups', 'skipped_ticks', 'fps', 'jitter_ms_mean', 'jitter_ms_p99', 'input_latency_ms_mean', 'input_latency_ms_p99')}
+            else:
+                result = {'ups': game.ticks/elapsed}
+            results.append({'loop': loop_name, 'target_ups': rate, **result, 'ups_error': result['ups']/rate - 1})
+    return results
+
+
+# playing needs numpy and the standard library only, these must not be imported by the PLAY_ONLY_MODULES
+HEAVY_MODULES = ('torch', 'matplotlib', 'IPython')
+PLAY_ONLY_MODULES = ('snake', 'batched_snake')
+
+
+def bench_imports(modules=PLAY_ONLY_MODULES, repeats=5, min_time=None, seed=0):
+    # each import in a fresh interpreter, timed by -X importtime. min_time is accepted for --quick
+    # and runs a single repeat
+    if min_time is not None:
+        repeats = 1
+    results = []
+    for module in modules:
+        code = f"import sys, {module}; print(' '.join(m for m in sys.modules if m.split('.')[0] in {HEAVY_MODULES!r}))"
+        times = []
+        for _ in range(repeats):
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', code],
+                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            # stderr lines are "import time: self [us] | cumulative | name", nested imports indented
+            for line in process.stderr.splitlines():
+                fields = line.split('|')
+                if len(fields) == 3 and fields[2].strip() == module and not fields[2][1:].startswith(' '):
+                    times.append(int(fields[1]))
+        heavy = sorted({name.split('.')[0] for name in process.stdout.split()})
+        results.append({
+            'module': module,
+            'ms_median': float(np.median(times))/1000,
+            'ms_min': min(times)/1000,
+            'heavy_modules': heavy,
+        })
+    return results
+
+
+BENCHMARKS = {
+    'play_step': bench_play_step,
+    'get_state': bench_get_state,
+    'render': bench_render,
+    'get_action': bench_get_action,
+    'train_step': bench_train_step,
+    'replay_sample': bench_replay_sample,
+    'planes': bench_planes,
+    'imports': bench_imports,
+    'tick': bench_tick,
+    'watch': bench_watch,
+    'time_to_score': bench_time_to_score,
+}
+
+
+def run_benchmarks(names=None, seed=0, quick=False):
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'seed': seed,
+        'results': {},
+    }
+    for name in names or BENCHMARKS:
+        kwargs = {'seed': seed}
+        if quick and name != 'render':
+            kwargs['min_time'] = 0.1
+        report['results'][name] = BENCHMARKS[name](**kwargs)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the game, agent and trainer hot paths")
+    parser.add_argument('benchmarks', nargs='*', help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help="shorter timing windows")
+    parser.add_argument('-o', '--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(args.benchmarks, args.seed, args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    # the play-only import path is a regression check as well as a timing
+    heavy = {r['module']: r['heavy_modules'] for r in report['results'].get('imports', []) if r['heavy_modules']}
+    if heavy:
+        sys.exit(f"play-only imports pulled in heavy modules: {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import pickle
+import sys
+
+import numpy as np
+
+from batched_snake import BatchedSnake
+from game import GameGrid
+from snake import Snake
+
+
+class ListSnake:
+    # The list-backed body, death, score and state of the original Snake, kept as a reference for the
+    # deque and occupancy index. Food placement is not part of it, step is handed the food the game spawned.
+
+    def __init__(self, grid_wh, x0, y0, walls):
+        self.width, self.height = grid_wh
+        self.x0, self.y0 = x0, y0
+        self.walls = walls
+
+    def reset(self, initial_length):
+        self.body = [(x, self.y0) for x in [self.x0-i % self.width for i in range(initial_length)]][::-1]
+        self.direction = 'right'
+        self.eating = []
+        self.to_eat = []
+        self.score = 0
+
+    def step(self, action, food):
+        key = Snake.MAPPING.get((self.direction, tuple(action)))
+        if key in Snake.DIRECTION_MAP:
+            self.direction = Snake.DIRECTION_MAP[key]
+        if not self.to_eat:
+            self.to_eat = [food]
+
+        if self.body[0] in self.eating:
+            self.eating.pop(0)
+            self.body.pop(0)
+            self.body.insert(0, self.body[0])
+        else:
+            self.body.pop(0)
+        xx, yy = Snake.UPDATE_MAP[self.direction]
+        if self.walls:
+            self.body.append((self.body[-1][0] + xx, self.body[-1][1] + yy))
+        else:
+            self.body.append(((self.body[-1][0] + xx) % self.width, (self.body[-1][1] + yy) % self.height))
+
+        ate = self.body[-1] in self.to_eat
+        if ate:
+            self.score += 1
+            self.eating.append(self.body[-1])
+            self.to_eat.pop(0)
+
+        head_x, head_y = self.body[-1]
+        dead = self.body[-1] in self.body[:-1] or (self.walls and not (0 <= head_x < self.width and 0 <= head_y < self.height))
+        if dead:
+            return -10, True, self.score
+        return (10 if ate else -0.05), False, self.score
+
+    def get_state(self):
+        head_x, head_y = self.body[-1]
+        food = [False]*4
+        if self.to_eat:
+            food_x, food_y = self.to_eat[0]
+            food = [head_y > food_y, head_y < food_y, head_x > food_x, head_x < food_x]
+        danger = [
+            (head_x, (head_y - 1) % self.height) in self.body,
+            (head_x, (head_y + 1) % self.height) in self.body,
+            ((head_x - 1) % self.width, head_y) in self.body,
+            ((head_x + 1) % self.width, head_y) in self.body,
+            (head_x, (head_y - 2) % self.height) in self.body,
+            (head_x, (head_y + 2) % self.height) in self.body,
+            ((head_x - 2) % self.width, head_y) in self.body,
+            ((head_x + 2) % self.width, head_y) in self.body,
+        ]
+        directions = [self.direction == d for d in ('up', 'down', 'left', 'right')]
+        return np.array(directions + food + danger, dtype=int)
+
+
+class FoodRecordingSnake(Snake):
+    def update_food(self):
+        super().update_food()
+        self.spawned = self.to_eat[0] if self.to_eat else None
+
+
+def check_trajectories(grid_sizes=(8, 20), n_steps=20_000, seed=0):
+    # seeded random play on Snake and on ListSnake, rewards, dones, scores and states must match at every step
+    for size in grid_sizes:
+        for walls in (True, False):
+            np.random.seed(seed)
+            game = FoodRecordingSnake((size, size), size//2, size//2, 3, walls=walls)
+            game.set_map_actions()
+            reference = ListSnake((size, size), size//2, size//2, walls)
+            actions = np.identity(game.action_size, dtype=int)[np.random.RandomState(seed + 1).randint(game.action_size, size=n_steps)]
+
+            game.reset(train=True)
+            reference.reset(game.initial_length)
+            episodes = 0
+            for step, action in enumerate(actions.tolist()):
+                result = game.play_step(action)
+                expected = reference.step(action, game.spawned)
+                if result != expected:
+                    raise AssertionError(f"{size}x{size} walls={walls} step {step}: play_step gave {result}, the list version {expected}")
+                if not result[1] and not np.array_equal(game.get_state(), reference.get_state()):
+                    raise AssertionError(f"{size}x{size} walls={walls} step {step}: get_state differs from the list version")
+                if result[1]:
+                    episodes += 1
+                    game.reset(train=True)
+                    reference.reset(game.initial_length)
+            if episodes < 10:
+                raise AssertionError(f"{size}x{size} walls={walls}: only {episodes} episodes in {n_steps} steps")
+
+
+def check_batched_truncation(n_games=64, max_steps=5, seed=0):
+    # games cut at max_steps come back reset, step has to report them done so that no transition links two games
+    env = BatchedSnake(n_games, (20, 20), 10, 10, 3, walls=False, max_steps=max_steps, seed=seed)
+    rng = np.random.RandomState(seed)
+    steps = np.zeros(n_games, dtype=np.int64)
+    for _ in range(4*max_steps):
+        _, rewards, dones, _ = env.step(rng.randint(env.action_size, size=n_games))
+        steps += 1
+        cut = steps >= max_steps
+        if not dones[cut].all():
+            raise AssertionError(f"games at max_steps={max_steps} were reset without a done flag")
+        if (dones & ~cut & (rewards != -10)).any():
+            raise AssertionError("games were reported done before max_steps without dying")
+        steps[dones] = 0
+
+
+def check_pickled_planes(n_steps=50, seed=0):
+    # train_parallel pickles the game for its actors, a planes game has to keep observing the board it plays on
+    np.random.seed(seed)
+    game = Snake((10, 10), 5, 5, 3, walls=False, observation='planes')
+    game.set_map_actions()
+    game = pickle.loads(pickle.dumps(game))
+    state = game.get_state().copy()
+    for _ in range(n_steps):
+        game.play_step(2)
+        next_state = game.get_state()
+        if np.array_equal(state, next_state):
+            raise AssertionError("the state of a pickled planes game did not change after play_step")
+        if not np.shares_memory(next_state, game.planes):
+            raise AssertionError("the state of a pickled planes game is not a view of its planes")
+        state = next_state.copy()
+
+
+def check_actions(seed=0):
+    # integer and one-hot actions turn the same way, an invalid one-hot keeps the direction as MAPPING.get did
+    game = Snake((10, 10), 5, 5, 3)
+    game.set_map_actions()
+    for direction in Snake.TURN_KEYS:
+        game.direction = direction
+        for index, one_hot in enumerate(np.identity(game.action_size, dtype=int).tolist()):
+            if game.map_action(index) != game.map_action(one_hot) or game.action_index(one_hot) != index:
+                raise AssertionError(f"action {index} and {one_hot} differ going {direction}")
+        for invalid in ([0, 0, 0], [1, 1, 0], [2, 0, 0]):
+            if game.map_action(invalid) is not None:
+                raise AssertionError(f"invalid action {invalid} turned the snake")
+            try:
+                game.action_index(invalid)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"invalid action {invalid} got an index")
+
+
+class CellsGame:
+    # the least a SPARSE_GRID game needs, drawing whatever is put in board
+    SPARSE_GRID = True
+    HEADER = ''
+
+    def __init__(self):
+        self.board = {}
+        self.changed = set()
+
+    def update_cells(self, full):
+        cells = self.board if full else self.changed
+        self.changed = set()
+        return [(x, y, self.board[x, y]) for x, y in cells]
+
+    def focus(self):
+        return None
+
+
+class NullStream:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def check_palette(n_chars=400, seed=0):
+    # past 256 distinct characters GameGrid widens its cells, every cell has to keep showing its own character
+    rng = np.random.RandomState(seed)
+    game = CellsGame()
+    grid = GameGrid(10, 6)
+    for i in range(n_chars):
+        char = chr(0x4e00 + i) if i % 3 == 0 else chr(0x100 + i)
+        for _ in range(3):
+            cell = (rng.randint(10), rng.randint(6))
+            game.board[cell] = char
+            game.changed.add(cell)
+        grid.print(game, NullStream())
+        shown = {(x, y): grid.palette[grid.cells[y, x]] for x, y in game.board}
+        if shown != game.board:
+            raise AssertionError(f"GameGrid shows the wrong characters after {len(grid.palette)} were seen")
+
+
+CHECKS = {
+    'trajectories': check_trajectories,
+    'batched_truncation': check_batched_truncation,
+    'pickled_planes': check_pickled_planes,
+    'actions': check_actions,
+    'palette': check_palette,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Equivalence and regression checks for the game and training code")
+    parser.add_argument('checks', nargs='*', help=f"checks to run, all by default: {', '.join(CHECKS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+
+    failed = []
+    for name in args.checks or CHECKS:
+        try:
+            CHECKS[name](seed=args.seed)
+        except AssertionError as error:
+            failed.append(name)
+            print(f"{name}: FAILED {error}")
+        else:
+            print(f"{name}: ok")
+    if failed:
+        sys.exit(f"failed checks: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import torch
+
+from batched_snake import BatchedSnake
+from model import DQN
+
+
+MODEL_PATHS = (
+    'model/model.pth',
+    'model/neg_reward.pth',
+    'model/model_free_walls.pth',
+    'model/model_walls_rectangular_grid.pth',
+)
+
+GRID_CONFIGS = (
+    {'grid_wh': (20, 20), 'x0': 3, 'y0': 3, 'initial_length': 3, 'walls': True},
+    {'grid_wh': (20, 20), 'x0': 3, 'y0': 3, 'initial_length': 3, 'walls': False},
+    {'grid_wh': (40, 20), 'x0': 3, 'y0': 3, 'initial_length': 3, 'walls': True},
+)
+
+
+def evaluate_model(model_path: str, grid_config: Dict[str, Any], n_games: int = 1000, seed: int = 0, max_steps: int = 1000) -> Dict[str, Any]:
+    # Plays n_games greedy episodes at once on a BatchedSnake, each capped at max_steps.
+    # Games that finish early keep being stepped by the batch but are no longer counted.
+    model = DQN.from_state_dict(torch.load(model_path))
+    input_size = model.fc1.in_features
+    torch.manual_seed(seed)
+    env = BatchedSnake(n_games, seed=seed, train=False, **grid_config)
+
+    scores = np.zeros(n_games, dtype=np.int64)
+    lengths = np.zeros(n_games, dtype=np.int64)
+    finished = np.zeros(n_games, dtype=bool)
+    dead = np.zeros(n_games, dtype=bool)
+
+    start = time.perf_counter()
+    states = env.get_state()
+    steps = 0
+    while not finished.all() and steps < max_steps:
+        with torch.inference_mode():
+            actions = model(torch.from_numpy(states[:, :input_size])).argmax(dim=1).numpy()
+        states, _, died, step_scores = env.step(actions)
+        steps += 1
+
+        playing = ~finished
+        lengths[playing] += 1
+        ended = playing & died
+        scores[ended] = step_scores[ended]
+        dead |= ended
+        finished |= ended
+    scores[~finished] = env.scores[~finished]
+    elapsed = time.perf_counter() - start
+
+    return {
+        'model': model_path,
+        **{k: list(v) if isinstance(v, tuple) else v for k, v in grid_config.items()},
+        'seed': seed,
+        'games': n_games,
+        'truncated': int((~dead).sum()),
+        'score_mean': float(scores.mean()),
+        'score_std': float(scores.std()),
+        'score_p50': float(np.percentile(scores, 50)),
+        'score_p99': float(np.percentile(scores, 99)),
+        'score_max': int(scores.max()),
+        'score_hist': np.bincount(scores).tolist(),
+        'length_mean': float(lengths.mean()),
+        'length_p50': float(np.percentile(lengths, 50)),
+        'length_p99': float(np.percentile(lengths, 99)),
+        'env_steps_per_sec': n_games*steps/elapsed,
+        'game_steps_per_sec': lengths.sum()/elapsed,
+        'seconds': elapsed,
+    }
+
+
+def run_job(job) -> Dict[str, Any]:
+    torch.set_num_threads(1)
+    return evaluate_model(*job)
+
+
+def evaluate(
+    model_paths: Iterable[str] = MODEL_PATHS,
+    n_games: int = 1000,
+    seeds: Iterable[int] = (0,),
+    grid_configs: Iterable[Dict[str, Any]] = GRID_CONFIGS,
+    max_steps: int = 1000,
+    n_workers: int = None
+    ) -> List[Dict[str, Any]]:
+
+    # one job per (model, grid config, seed), spread over a spawn process pool when there are cores to spare
+    jobs = [
+        (model_path, grid_config, n_games, seed, max_steps)
+        for model_path in model_paths
+        for grid_config in grid_configs
+        for seed in seeds
+    ]
+    if n_workers is None:
+        n_workers = min(len(jobs), os.cpu_count() or 1)
+    if n_workers <= 1:
+        return [evaluate_model(*job) for job in jobs]
+    with ProcessPoolExecutor(n_workers, mp_context=mp.get_context('spawn')) as pool:
+        return list(pool.map(run_job, jobs))
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    columns = (
+        ('model', '{}'), ('grid_wh', '{}'), ('walls', '{}'), ('seed', '{}'),
+        ('score_mean', '{:.2f}'), ('score_p50', '{:.0f}'), ('score_p99', '{:.0f}'), ('score_max', '{}'),
+        ('length_mean', '{:.1f}'), ('length_p50', '{:.0f}'), ('length_p99', '{:.0f}'), ('truncated', '{}'),
+        ('game_steps_per_sec', '{:.0f}'),
+    )
+    rows = [[name for name, _ in columns]]
+    for result in results:
+        rows.append([
+            fmt.format(os.path.basename(result[name]) if name == 'model' else 'x'.join(map(str, result[name])) if name == 'grid_wh' else result[name])
+            for name, fmt in columns
+        ])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless side by side evaluation of saved Snake models")
+    parser.add_argument('models', nargs='*', default=MODEL_PATHS, help="checkpoints, the ones in model/ by default")
+    parser.add_argument('-n', '--games', type=int, default=1000, help="games per model, grid and seed")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--grid', type=int, nargs=2, metavar=('W', 'H'), help="evaluate on this grid only")
+    parser.add_argument('--no-walls', dest='walls', action='store_false')
+    parser.add_argument('--max-steps', type=int, default=1000)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--json', action='store_true', help="print the full results as JSON")
+    args = parser.parse_args(argv)
+
+    grid_configs = GRID_CONFIGS
+    if args.grid:
+        grid_configs = [{'grid_wh': tuple(args.grid), 'x0': 3, 'y0': 3, 'initial_length': 3, 'walls': args.walls}]
+
+    start = time.perf_counter()
+    results = evaluate(args.models, args.games, args.seeds, grid_configs, args.max_steps, args.workers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_table(results))
+        print(f"{len(results)} runs in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
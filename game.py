@@ -1,15 +1,22 @@
 import asyncio
+import os
+import random
 import numpy as np
 import termios
 import tty
 import sys
-import select
 import time
+import unicodedata
+from collections import deque
 from abc import ABC, abstractmethod
-from typing import Dict, List, Tuple, Any
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any, TextIO, Union
 
-from agent import GameAgent
-from utils import getch, plot_progress
+from instrumentation import NullMonitor
+from scheduler import TickScheduler
+from utils import getch, ProgressPlotter
+
+# torch, matplotlib and IPython are only imported by train and watch_agent_play, so that playing and
+# headless workers start with numpy and the standard library, `python bench.py imports` checks it
 
 
 class Game(ABC):
@@ -17,11 +24,19 @@ class Game(ABC):
     PLAY_CONDITION = False
     HEADER = ""
 
+    # keys applied per tick, the rest wait for the next ticks so that quick presses are not lost
+    KEYS_PER_TICK = 1
+    # ticks run back to back after the loop was held up, and the frames per second cap, None renders after every tick
+    MAX_CATCH_UP = 5
+    FPS = None
+
     @abstractmethod
     def __init__(self, grid_wh: Tuple[int, int], ups: int):
         width, height = grid_wh
         self.grid = GameGrid(width=width, height=height)
         self.UPDATE_PER_SECOND = ups
+        self.keys = deque()
+        self.scheduler = None
 
     @abstractmethod
     def update_game(self) -> None:
@@ -35,11 +50,56 @@ class Game(ABC):
     def on_key_press(self, key: str) -> None:
         raise NotImplementedError
 
-    async def play(self):
+    # games setting SPARSE_GRID implement update_cells instead of drawing in update_grid
+    SPARSE_GRID = False
+
+    def update_cells(self, full: bool) -> Iterable[Tuple[int, int, str]]:
+        # (x, y, char) of the cells that changed since the last call, or of every non blank cell when full
+        raise NotImplementedError
+
+    def focus(self) -> Optional[Tuple[int, int]]:
+        # the cell a viewport smaller than the board keeps in view
+        return None
+
+    def snapshot(self) -> Any:
+        # a compact immutable copy of what update_grid draws, replayed by Watcher in 'highlights' mode
+        raise NotImplementedError
+
+    def show_snapshot(self, snapshot: Any) -> None:
+        # sets up the board a snapshot was taken of for drawing, the game can only be played on
+        # once the snapshot of its current state has been shown
+        raise NotImplementedError
+
+    def key_pressed(self, key: str, read_time: float = None) -> None:
+        # buffers a key for the next ticks, q quits right away
+        if key == 'q':
+            self.PLAY_CONDITION = False
+            return
+        self.keys.append((key, time.monotonic() if read_time is None else read_time))
+
+    def tick(self) -> None:
+        for _ in range(min(self.KEYS_PER_TICK, len(self.keys))):
+            key, read_time = self.keys.popleft()
+            self.on_key_press(key)
+            self.scheduler.key_applied(read_time)
+        self.update_game()
+
+    async def play(self, stream: TextIO = None, writable: Callable[[], bool] = None) -> None:
+        # ticks at UPDATE_PER_SECOND on the scheduler's clock, rendering once after each batch of due ticks.
+        # Frames are skipped while writable returns False, the next one is drawn against the last one written
+        scheduler = self.scheduler = TickScheduler(self.UPDATE_PER_SECOND, self.MAX_CATCH_UP, self.FPS)
+        self.grid.print(self, stream)
+        scheduler.frame_rendered()
         while self.PLAY_CONDITION:
-            self.grid.print(self)
-            self.update_game()
-            await asyncio.sleep(1/self.UPDATE_PER_SECOND)
+            await scheduler.wait()
+            ticks = scheduler.due()
+            for _ in range(ticks):
+                self.tick()
+                if not self.PLAY_CONDITION:
+                    break
+            if ticks and scheduler.render_due() and (writable is None or writable()):
+                self.grid.print(self, stream)
+                scheduler.frame_rendered()
 
     async def key_task(self) -> None:
         while self.PLAY_CONDITION:
@@ -48,42 +108,53 @@ class Game(ABC):
             self.on_key_press(key)
             if key == 'q':
                 self.PLAY_CONDITION = False
-    
-    async def single_thread_key_event(self) -> None:
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        tty.setraw(sys.stdin.fileno())
 
-        while self.PLAY_CONDITION:
-            await asyncio.sleep(1/self.UPDATE_PER_SECOND)            
-            inputready, _, _ = select.select([fd], [],[], 0.0001)
-            if fd in inputready:
-                key = sys.stdin.read(1)
-                self.on_key_press(key)
-                if key == 'q':
-                    self.PLAY_CONDITION = False
-                    
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-            
-    async def main_loop(self) -> None:
-        tasks = [self.play(), self.single_thread_key_event()]
-        await asyncio.gather(*tasks)
+    def read_keys(self, fd: int) -> None:
+        # add_reader callback, takes every byte available so that no key waits for the next tick to be read
+        read_time = time.monotonic()
+        data = os.read(fd, 1024)
+        if not data:
+            asyncio.get_running_loop().remove_reader(fd)
+            return
+        for key in data.decode(errors='ignore'):
+            self.key_pressed(key, read_time)
+
+    async def main_loop(self, stream: TextIO = None, fd: int = None) -> None:
+        # keys come from fd, stdin by default, which is put in raw mode when it is a terminal
+        loop = asyncio.get_running_loop()
+        fd = sys.stdin.fileno() if fd is None else fd
+        old_settings = None
+        if os.isatty(fd):
+            old_settings = termios.tcgetattr(fd)
+            tty.setraw(fd)
+        loop.add_reader(fd, self.read_keys, fd)
+        try:
+            await self.play(stream)
+        finally:
+            loop.remove_reader(fd)
+            if old_settings is not None:
+                termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
     def __call__(self) -> None:
         loop = asyncio.new_event_loop()
         loop.run_until_complete(self.main_loop())
         loop.close()
-        
 
 
 class TrainableGame(Game):
 
+    STATE_DTYPE = np.float32
+    # bumped whenever get_state changes meaning, recorded in trajectory files
+    STATE_VERSION = 1
+    # (channels, height, width) when get_state is a flattened stack of board planes, GameAgent then uses a ConvDQN
+    STATE_SHAPE = None
+
     @abstractmethod
     def __init__(self, grid_wh: Tuple[int,int], ups: int = 15):
         super().__init__(grid_wh, ups)
 
     @abstractmethod
-    def play_step(self, action: List[int]) -> Tuple[float, bool, float]:
+    def play_step(self, action: Union[int, List[int]]) -> Tuple[float, bool, float]:
         raise NotImplementedError
 
     @abstractmethod
@@ -94,6 +165,14 @@ class TrainableGame(Game):
     def reset(self, train: bool = False) -> None:
         raise NotImplementedError
 
+    def write_state(self, out: np.ndarray) -> None:
+        # copies the leading len(out) state features into a caller owned buffer
+        out[:] = self.get_state()[:len(out)]
+
+    def trace(self) -> Tuple[int, int, int, int, int]:
+        # (head_x, head_y, food_x, food_y, length) recorded next to every transition by trajectory.py
+        return -1, -1, -1, -1, 0
+
     def set_map_actions(self) -> None:
         action_size = len(self.ACTION_MAP) 
         action_matrix = np.identity(action_size, dtype=int)
@@ -104,12 +183,28 @@ class TrainableGame(Game):
         self.map_actions = map_actions
         self.action_size = action_size
 
-    def map_action(self, action: List[int]) -> str:
+    def action_index(self, action: Union[int, List[int]]) -> int:
+        # actions are indices into ACTION_MAP, one-hot lists are still accepted everywhere
+        if isinstance(action, (int, np.integer)):
+            return int(action)
+        index = int(np.argmax(action))
+        if action[index] != 1 or np.count_nonzero(action) != 1:
+            raise ValueError(f"{action} is not a one-hot action")
+        return index
+
+    def map_action(self, action: Union[int, List[int]]) -> str:
+        if isinstance(action, (int, np.integer)):
+            return self.map_actions[action][1]
         for k,v in self.map_actions:
             if np.array_equal(action, k):
                 return v
         return 'none'
 
+    TRAIN_PHASES = (
+        'get_state', 'get_action', 'render', 'render_sleep', 'play_step',
+        'train_short_memory', 'remember', 'record', 'reset', 'train_long_memory', 'plot_progress'
+    )
+
     def train(
         self, 
         watch_training: bool = True, 
@@ -118,12 +213,34 @@ class TrainableGame(Game):
         max_games: int = 10_000,
         max_steps: int = None, 
         model_filename: str = 'model.pth',
-        train_params: Dict[str, Any] = {} 
-        ) -> None:
+        train_params: Dict[str, Any] = {},
+        monitor: NullMonitor = None,
+        trajectory_path: str = None,
+        seed: int = None,
+        agent: Any = None,
+        verbose: bool = True,
+        watch_mode: str = 'every',
+        watch_params: Dict[str, Any] = {}
+        ) -> Dict[str, Any]:
+
+        # agent continues training a GameAgent from an earlier call, train_params are then not used.
+        # Returns the scores of the games played and the agent
+        import torch
+        from agent import GameAgent
+
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+            torch.manual_seed(seed)
 
         game = self
         game.set_map_actions()
-        agent = GameAgent(game, **train_params)
+        agent = agent or GameAgent(game, **train_params)
+
+        trajectory = None
+        if trajectory_path:
+            from trajectory import TrajectoryWriter
+            trajectory = TrajectoryWriter(trajectory_path, game, seed)
 
         if max_steps == None:
             max_steps = np.inf
@@ -132,6 +249,15 @@ class TrainableGame(Game):
             max_games = np.inf
 
         time_sleep = 1/watching_speed if watching_speed else 1/game.UPDATE_PER_SECOND
+        watcher = Watcher(game, watch_mode, time_sleep, **watch_params) if watch_training else None
+
+        monitor = monitor or NullMonitor()
+        monitor.begin(self.TRAIN_PHASES)
+        monitor.count('games', 0)
+        monitor.record('replay_size', 0)
+        monitor.record('loss', None)
+
+        plotter = ProgressPlotter() if plot else None
 
         scores = []
         mean_scores = []
@@ -140,97 +266,420 @@ class TrainableGame(Game):
         
         step_counter = 0
         game_counter = 0
-        while True and game_counter < max_games:
-            old_state = agent.get_state()
-            action = agent.get_action(old_state)
-            
-            if watch_training:
-                game.grid.print(game)
-                time.sleep(time_sleep)
-            
-            reward, game_over, score = game.play_step(action)
-            
-            new_state = agent.get_state()
-            agent.train_short_memory(old_state, action, reward, new_state, game_over)
-            agent.remember(old_state, action, reward, new_state, game_over)
-
-            step_counter += 1
-
-            if game_over or step_counter >= max_steps:
-                game.reset(train=True)
-                agent.n_games += 1
-                agent.train_long_memory()
-
-                if score > record:
-                    record = score
-                    #agent.model.save(model_filename)
-
-                scores.append(score)
-                total_score += score
-                mean_score = total_score / agent.n_games
-                mean_scores.append(mean_score)
+        start = time.perf_counter()
+        try:
+            while True and game_counter < max_games:
+                monitor.start_step()
+                old_state = agent.get_state()
+                monitor.lap('get_state')
+                action = agent.act(old_state)
+                monitor.lap('get_action')
                 
-                if plot:
-                    plot_progress(scores, mean_scores)
-                else:
-                    print('Game', agent.n_games, 'Score', score, 'Record:', record, 'Mean Score:', mean_score)
+                if watcher:
+                    watcher.frame()
+                    monitor.lap('render')
+                    watcher.pause()
+                    monitor.lap('render_sleep')
                 
-                game_counter += 1
-                step_counter = 0
+                reward, game_over, score = game.play_step(action)
+                monitor.lap('play_step')
+                
+                new_state = agent.get_state()
+                monitor.lap('get_state')
+                if agent.train_every:
+                    agent.remember(old_state, action, reward, new_state, game_over)
+                    monitor.lap('remember')
+                    loss = agent.train_scheduled()
+                    monitor.lap('train_long_memory')
+                    if loss is not None:
+                        monitor.record('loss', loss)
+                else:
+                    agent.train_short_memory(old_state, action, reward, new_state, game_over)
+                    monitor.lap('train_short_memory')
+                    agent.remember(old_state, action, reward, new_state, game_over)
+                    monitor.lap('remember')
+
+                step_counter += 1
+                if trajectory:
+                    trajectory.append(old_state, action, reward, new_state, game_over, step_counter >= max_steps, game.trace())
+                    monitor.lap('record')
+
+                if game_over or step_counter >= max_steps:
+                    if watcher:
+                        watcher.game_over()
+                        monitor.lap('render')
+                    game.reset(train=True)
+                    agent.n_games += 1
+                    monitor.lap('reset')
+                    if not agent.train_every:
+                        loss = agent.train_long_memory()
+                        monitor.lap('train_long_memory')
+                        monitor.record('loss', loss)
+                    monitor.record('replay_size', len(agent.memory))
+                    monitor.count('games')
+
+                    if score > record:
+                        record = score
+                        #agent.model.save(model_filename)
+
+                    scores.append(score)
+                    total_score += score
+                    mean_score = total_score / len(scores)
+                    mean_scores.append(mean_score)
+                    
+                    if plot:
+                        plotter.push(score, mean_score)
+                        monitor.lap('plot_progress')
+                    else:
+                        if verbose:
+                            print('Game', agent.n_games, 'Score', score, 'Record:', record, 'Mean Score:', mean_score)
+                        if watch_training:
+                            game.grid.invalidate()
+                    
+                    game_counter += 1
+                    step_counter = 0
+                monitor.end_step()
+        finally:
+            if plotter:
+                plotter.close()
+            if trajectory:
+                trajectory.close()
+            monitor.close()
+
+        return {
+            'games': game_counter,
+            'scores': scores,
+            'mean_score': total_score/len(scores) if scores else 0.,
+            'record': record,
+            'seconds': time.perf_counter() - start,
+            'agent': agent,
+        }
     
+    def train_parallel(self, n_workers: int = None, **kwargs) -> Dict[str, Any]:
+        # K actor processes play their own copies of the game, this process learns from their transitions
+        from actor_learner import train_parallel
+        return train_parallel(self, n_workers, **kwargs)
+
     def watch_agent_play(
         self, 
         max_games: int = 30, 
         forever: bool = True, 
         model_path: str = 'model/model.pth', 
-        watching_speed: int = None
+        watching_speed: int = None,
+        backend: str = None,
+        memoize: bool = False,
+        max_steps: int = 1000,
+        watch_mode: str = 'every',
+        watch_params: Dict[str, Any] = {}
         ) -> None:
         
+        # watch_mode and watch_params pick which steps are drawn, see Watcher
+        from agent import GameAgent
+
         game = self
         game.set_map_actions()
         agent = GameAgent(game)
         agent.load(model_path)
+        policy = agent.policy(backend, memoize)
 
         sleep_time = 1/watching_speed if watching_speed else 1/game.UPDATE_PER_SECOND
+        watcher = Watcher(game, watch_mode, sleep_time, **watch_params)
+
+        if max_steps is None:
+            max_steps = np.inf
 
         game_counter = 0
+        step_counter = 0
         while True:
-            old_state = agent.get_state()
-            action = agent.get_action(old_state)
-            game.grid.print(game)
-            time.sleep(sleep_time)
+            action = policy.act(game.get_state())
+            watcher.frame()
+            watcher.pause()
             _, game_over, _ = game.play_step(action)
-            if game_over: 
-                if not forever and game_counter < max_games:
+            step_counter += 1
+            # trained agents can circle forever without eating, max_steps ends those games
+            if game_over or step_counter >= max_steps: 
+                watcher.game_over()
+                game_counter += 1
+                step_counter = 0
+                if not forever and game_counter >= max_games:
                     break
                 game.reset()
     
 
+class Watcher:
+    # Decides which steps of a watched game are drawn. 'every' draws each step and sleeps `sleep` after it,
+    # 'skip' draws every `every`-th step at full speed and 'fps' at most `fps` frames a second of wall clock,
+    # both also draw the last step of each game. 'highlights' draws nothing while playing and, at each game
+    # over, replays the last `highlights` steps from Game.snapshot copies kept in a ring buffer.
+
+    MODES = ('every', 'skip', 'fps', 'highlights')
+
+    def __init__(self, game: Game, mode: str = 'every', sleep: float = 0., every: int = 10, fps: float = 30., highlights: int = 100, stream: TextIO = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown watch mode {mode}, use one of {self.MODES}")
+        self.game = game
+        self.mode = mode
+        self.sleep = sleep
+        self.every = every
+        self.frame_period = 1/fps
+        self.stream = stream
+        self.snapshots = deque(maxlen=highlights)
+        self.steps = 0
+        self.frames = 0
+        self.next_frame = 0.
+
+    def draw(self) -> None:
+        self.game.grid.print(self.game, self.stream)
+        self.frames += 1
+
+    def frame(self) -> None:
+        # called before every step
+        self.steps += 1
+        if self.mode == 'every':
+            self.draw()
+        elif self.mode == 'skip':
+            if (self.steps - 1) % self.every == 0:
+                self.draw()
+        elif self.mode == 'fps':
+            now = time.monotonic()
+            if now >= self.next_frame:
+                self.draw()
+                self.next_frame = now + self.frame_period
+        else:
+            self.snapshots.append(self.game.snapshot())
+
+    def pause(self) -> None:
+        if self.mode == 'every' and self.sleep:
+            time.sleep(self.sleep)
+
+    def game_over(self) -> None:
+        # called after the last step of a game, before the reset
+        if self.mode in ('skip', 'fps'):
+            self.draw()
+        elif self.mode == 'highlights':
+            self.snapshots.append(self.game.snapshot())
+            # the final snapshot is the board as it is now, so the game is left as it was found,
+            # all but the header, which the replays mark
+            header = self.game.HEADER
+            for i, snapshot in enumerate(self.snapshots, 1):
+                self.game.show_snapshot(snapshot)
+                self.game.HEADER += f" - replay {i}/{len(self.snapshots)}"
+                self.draw()
+                if self.sleep:
+                    time.sleep(self.sleep)
+            self.game.HEADER = header
+            self.snapshots.clear()
+        self.steps = 0
+
+
 class GameGrid:
-    def __init__(self, width: int = 25, height: int = 25):
+    # Games either redraw the dense character grid every frame in update_grid, or set SPARSE_GRID and
+    # report the cells that changed through update_cells. Sparse games are kept in `cells`, one byte per
+    # cell indexing `palette` (two once more than 256 characters were seen), so a frame costs what changed
+    # rather than width*height.
+    # A viewport smaller than the board shows the part of it around game.focus().
+
+    def __init__(self, width: int = 25, height: int = 25, viewport: Tuple[int, int] = None):
         self.width = width
         self.height = height
-        self.grid = np.full((height, width), ' ')        
-    
+        self._grid = None
+        self.cells = None
+        self.cell_dtype = np.uint8
+        self.palette = [' ']
+        self.codes = {' ': 0}
+        self.wide_codes = np.zeros(256, dtype=bool)
+        self.viewport = (min(viewport[0], width), min(viewport[1], height)) if viewport else (width, height)
+        self.view_x = self.view_y = 0
+        self.invalidate()
+
+    @property
+    def grid(self) -> np.ndarray:
+        # dense grid for update_grid games, only allocated when one draws on it
+        if self._grid is None:
+            self._grid = np.full((self.height, self.width), ' ')
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid: np.ndarray) -> None:
+        self._grid = grid
+
     def reset_grid(self) -> None:
-        self.grid = np.full((self.height, self.width), ' ')
+        self.grid.fill(' ')
+
+    def invalidate(self) -> None:
+        # forget what is on the terminal so that the next print redraws everything
+        self.previous = None
+        self.previous_header = None
+        self.wide_rows = None
+
+    def clear(self) -> None:
+        # forget the sparse cells too, the next print asks the game for all of them
+        self.cells = None
+        self.invalidate()
+
+    def print(self, game: Game, stream: TextIO = None) -> None:
+        if game.SPARSE_GRID:
+            frame = self.sparse_frame(game)
+        else:
+            self.reset_grid()
+            game.update_grid()
+
+            header_lines = game.HEADER.count('\n') + 1
+            if (self.previous is None or self.previous.shape != self.grid.shape
+                    or self.previous_header.count('\n') + 1 != header_lines):
+                frame = self.full_frame(game.HEADER)
+            else:
+                frame = self.diff_frame(game.HEADER, header_lines)
+
+        stream = stream or sys.stdout
+        stream.write(frame)
+        stream.flush()
+
+    def code(self, char: str) -> int:
+        code = self.codes.get(char)
+        if code is None:
+            code = len(self.palette)
+            if code == len(self.wide_codes):
+                self.widen()
+            self.codes[char] = code
+            self.palette.append(char)
+            self.wide_codes[code] = bool(self.wide_chars(char))
+        return code
+
+    def widen(self) -> None:
+        # the 257th character moves cells from one byte to two, there is nothing wider past 65536
+        if self.cell_dtype is np.uint16:
+            raise ValueError(f"GameGrid palette is full, a board can show at most {len(self.wide_codes)} distinct characters")
+        self.cell_dtype = np.uint16
+        self.wide_codes = np.concatenate([self.wide_codes, np.zeros(2**16 - len(self.wide_codes), dtype=bool)])
+        if self.cells is not None:
+            self.cells = self.cells.astype(np.uint16)
+
+    def scroll_to(self, x: int, y: int) -> bool:
+        # moves the viewport when (x, y) gets within a quarter of it from an edge, returns whether it moved
+        view_w, view_h = self.viewport
+        view_x, view_y = self.view_x, self.view_y
+        if not view_x + view_w//4 <= x < view_x + view_w - view_w//4:
+            view_x = min(max(x - view_w//2, 0), self.width - view_w)
+        if not view_y + view_h//4 <= y < view_y + view_h - view_h//4:
+            view_y = min(max(y - view_h//2, 0), self.height - view_h)
+        moved = (view_x, view_y) != (self.view_x, self.view_y)
+        self.view_x, self.view_y = view_x, view_y
+        return moved
+
+    def sparse_frame(self, game: Game) -> str:
+        full = self.cells is None
+        if full:
+            self.cells = np.zeros((self.height, self.width), dtype=self.cell_dtype)
+
+        cells = self.cells
+        changed = []
+        for x, y, char in game.update_cells(full):
+            code = self.codes.get(char)
+            if code is None:
+                code = self.code(char)
+                # a new character can widen cells into a new array
+                cells = self.cells
+            if cells[y, x] != code:
+                cells[y, x] = code
+                changed.append((x, y))
+
+        header = game.HEADER
+        if self.viewport != (self.width, self.height):
+            focus = game.focus()
+            if focus is not None and self.scroll_to(*focus):
+                self.invalidate()
+            view_w, view_h = self.viewport
+            header += f"  [{self.view_x}:{self.view_x + view_w}, {self.view_y}:{self.view_y + view_h}] of {self.width}x{self.height}"
+
+        header_lines = header.count('\n') + 1
+        if self.previous_header is None or self.previous_header.count('\n') + 1 != header_lines:
+            return self.full_view_frame(header)
+        return self.sparse_diff_frame(header, header_lines, changed)
+
+    def view(self) -> np.ndarray:
+        view_w, view_h = self.viewport
+        return self.cells[self.view_y:self.view_y + view_h, self.view_x:self.view_x + view_w]
+
+    def full_view_frame(self, header: str) -> str:
+        view = self.view()
+        palette = np.array(self.palette)
+        border = '  ' + "# "*view.shape[1]
+        rows = ['# ' + ' '.join(row) + ' #' for row in palette[view].tolist()]
+        self.previous_header = header
+        self.wide_rows = set(np.flatnonzero(self.wide_codes[view].any(axis=1)))
+        return "\033[H\033[2J" + header + '\n\r\n' + '\n\r'.join([border, *rows, border]) + '\n\r\n'
+
+    def sparse_diff_frame(self, header: str, header_lines: int, changed: List[Tuple[int, int]]) -> str:
+        # same layout as diff_frame, only over the cells inside the viewport
+        top = header_lines + 3
+        parts = []
+        if header != self.previous_header:
+            parts.append("\033[H\033[2K" + header.replace('\n', '\n\r\033[2K'))
+            self.previous_header = header
+
+        view_w, view_h = self.viewport
+        cells, palette, wide_codes = self.cells, self.palette, self.wide_codes
+        redraw = set()
+        for x, y in changed:
+            i, j = x - self.view_x, y - self.view_y
+            if 0 <= i < view_w and 0 <= j < view_h:
+                code = cells[y, x]
+                if j in self.wide_rows or wide_codes[code]:
+                    redraw.add(j)
+                else:
+                    parts.append(f"\033[{top + j};{3 + 2*i}H{palette[code]}")
+        if redraw:
+            view = self.view()
+            for j in sorted(redraw):
+                row = view[j]
+                parts.append(f"\033[{top + j};1H# " + ' '.join([palette[code] for code in row.tolist()]) + " #\033[K")
+                if wide_codes[row].any():
+                    self.wide_rows.add(j)
+                else:
+                    self.wide_rows.discard(j)
+
+        parts.append(f"\033[{top + view_h + 2};1H")
+        return ''.join(parts)
+
+    def full_frame(self, header: str) -> str:
+        border = '  ' + "# "*self.width
+        rows = ['# ' + ' '.join(row) + ' #' for row in self.grid.tolist()]
+        self.previous = self.grid.copy()
+        self.previous_header = header
+        self.wide_rows = set(np.flatnonzero(np.isin(self.grid, list(self.wide_chars(np.unique(self.grid)))).any(axis=1)))
+        return "\033[H\033[2J" + header + '\n\r\n' + '\n\r'.join([border, *rows, border]) + '\n\r\n'
+
+    def diff_frame(self, header: str, header_lines: int) -> str:
+        # cell (i, j) sits on terminal row header_lines + 3 + j, column 3 + 2*i
+        top = header_lines + 3
+        parts = []
+        if header != self.previous_header:
+            parts.append("\033[H\033[2K" + header.replace('\n', '\n\r\033[2K'))
+            self.previous_header = header
+
+        rows, cols = np.nonzero(self.grid != self.previous)
+        if len(rows):
+            chars = self.grid[rows, cols].tolist()
+            wide = self.wide_chars(set(chars))
+            rows, cols = rows.tolist(), cols.tolist()
+            # wide characters shift the rest of their row, changed rows holding one are redrawn whole
+            redraw = {j for j, char in zip(rows, chars) if j in self.wide_rows or char in wide}
+            for j, i, char in zip(rows, cols, chars):
+                if j not in redraw:
+                    parts.append(f"\033[{top + j};{3 + 2*i}H{char}")
+            for j in sorted(redraw):
+                row = self.grid[j].tolist()
+                parts.append(f"\033[{top + j};1H# " + ' '.join(row) + " #\033[K")
+                if self.wide_chars(set(row)):
+                    self.wide_rows.add(j)
+                else:
+                    self.wide_rows.discard(j)
+            np.copyto(self.previous, self.grid)
 
-    def print(self, game: Game) -> None:
-        self.reset_grid()
-        game.update_grid()
-        
-        print("\033c", end="")
-        
-        print(game.HEADER, end="")
-        print('\n\r')
-        
-        game_grid = ""
-        game_grid += '  ' + "# "*self.width + '\n\r'
-        for j in range(self.height):
-            game_grid += '# '
-            for i in range(self.width):
-                game_grid+=self.grid[j, i]+' '
-            game_grid+='#\n\r'
-        game_grid += '  ' + "# "*self.width + '\n\r'
-
-        print(game_grid)
\ No newline at end of file
+        parts.append(f"\033[{top + self.height + 2};1H")
+        return ''.join(parts)
+
+    @staticmethod
+    def wide_chars(chars) -> set:
+        return {c for c in chars if unicodedata.east_asian_width(c) in ('W', 'F')}
@@ -0,0 +1,182 @@
+import csv
+import json
+import logging
+import time
+from array import array
+from typing import Any, Callable, Dict, Iterable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class NullMonitor:
+    # what TrainableGame.train uses when no monitor is given, every hook is a no-op
+
+    enabled = False
+
+    def begin(self, phases: Iterable[str] = ()) -> None:
+        pass
+
+    def start_step(self) -> None:
+        pass
+
+    def lap(self, phase: str) -> None:
+        pass
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+    def record(self, name: str, value: float) -> None:
+        pass
+
+    def end_step(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class TrainingMonitor(NullMonitor):
+    # Times the phases of a training step and emits a summary every summary_every seconds.
+    # A phase is timed from the previous lap (or start_step) to its own lap call.
+
+    enabled = True
+
+    def __init__(
+        self,
+        summary_every: float = 10.,
+        hooks: Iterable[Callable[[Dict[str, Any]], None]] = (),
+        log: bool = True,
+        csv_path: str = None,
+        jsonl_path: str = None
+        ):
+
+        self.summary_every = summary_every
+        self.hooks = list(hooks)
+        if log:
+            self.hooks.append(log_summary)
+        if csv_path:
+            self.hooks.append(CSVSink(csv_path))
+        if jsonl_path:
+            self.hooks.append(JSONLSink(jsonl_path))
+        self.begin()
+
+    def add_hook(self, hook: Callable[[Dict[str, Any]], None]) -> None:
+        self.hooks.append(hook)
+
+    def begin(self, phases: Iterable[str] = ()) -> None:
+        self.phases = {phase: array('d') for phase in phases}
+        self.counters = {}
+        self.gauges = {}
+        self.total_steps = 0
+        self.steps = 0
+        self.window_start = self.last = time.perf_counter()
+        self.next_summary = self.window_start + self.summary_every
+
+    def start_step(self) -> None:
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        durations = self.phases.get(phase)
+        if durations is None:
+            durations = self.phases[phase] = array('d')
+        durations.append(now - self.last)
+        self.last = now
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def end_step(self) -> None:
+        self.steps += 1
+        if time.perf_counter() >= self.next_summary:
+            self.flush()
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.window_start
+        summary = {
+            'time': time.time(),
+            'elapsed': elapsed,
+            'steps': self.steps,
+            'total_steps': self.total_steps + self.steps,
+            'steps_per_sec': self.steps/elapsed if elapsed else 0.,
+            **self.counters,
+            **self.gauges,
+            'phases': {},
+        }
+        for phase, durations in self.phases.items():
+            durations = np.frombuffer(durations, dtype=np.float64) if durations else np.zeros(1)
+            summary['phases'][phase] = {
+                'calls': len(self.phases[phase]),
+                'mean_us': 1e6*durations.mean(),
+                'p99_us': 1e6*np.percentile(durations, 99),
+                'share': durations.sum()/elapsed if elapsed else 0.,
+            }
+        return summary
+
+    def flush(self) -> None:
+        summary = self.summary()
+        for hook in self.hooks:
+            hook(summary)
+
+        self.total_steps += self.steps
+        self.steps = 0
+        self.counters = dict.fromkeys(self.counters, 0)
+        for phase in self.phases:
+            self.phases[phase] = array('d')
+        self.window_start = time.perf_counter()
+        self.next_summary = self.window_start + self.summary_every
+
+    def close(self) -> None:
+        if self.steps:
+            self.flush()
+        for hook in self.hooks:
+            if hasattr(hook, 'close'):
+                hook.close()
+
+
+def flatten_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    row = {k: v for k, v in summary.items() if k != 'phases'}
+    for phase, stats in summary['phases'].items():
+        for stat, value in stats.items():
+            row[f'{phase}_{stat}'] = value
+    return row
+
+
+def log_summary(summary: Dict[str, Any]) -> None:
+    logger.info(json.dumps(summary))
+
+
+class JSONLSink:
+    def __init__(self, path: str):
+        self.file = open(path, 'a')
+
+    def __call__(self, summary: Dict[str, Any]) -> None:
+        self.file.write(json.dumps(summary) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class CSVSink:
+    # columns are fixed by the first summary written, phases should be declared up front with begin()
+    def __init__(self, path: str):
+        self.file = open(path, 'a', newline='')
+        self.writer = None
+
+    def __call__(self, summary: Dict[str, Any]) -> None:
+        row = flatten_summary(summary)
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(row), extrasaction='ignore')
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
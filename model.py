@@ -1,4 +1,6 @@
+import copy
 import os
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -14,6 +16,18 @@ class DQN(nn.Module):
         x = F.relu(self.fc1(x))
         x = self.fc3(x)
         return x
+
+    @property
+    def input_size(self):
+        return self.fc1.in_features
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        # sizes come from the checkpoint, model/neg_reward.pth for instance has 128 hidden units
+        hidden_size, input_size = state_dict['fc1.weight'].shape
+        model = cls(input_size, hidden_size, state_dict['fc3.weight'].shape[0])
+        model.load_state_dict(state_dict)
+        return model
     
     def save(self, file_name='model.pth'):
         model_folder = './model'
@@ -23,43 +37,203 @@ class DQN(nn.Module):
         torch.save(self.state_dict(), file_name)
 
 
+class ConvDQN(nn.Module):
+    # DQN over board planes. Takes the flattened (channels, height, width) observation as the games
+    # return it, a single state or a batch, and reshapes it to images without copying.
+
+    def __init__(self, state_shape, hidden_size, output_size):
+        super().__init__()
+        channels, height, width = state_shape
+        self.register_buffer('state_shape', torch.tensor(state_shape))
+        self.conv1 = nn.Conv2d(channels, 16, 3, padding=1)
+        self.conv2 = nn.Conv2d(16, 32, 3, stride=2, padding=1)
+        self.fc1 = nn.Linear(32*((height + 1)//2)*((width + 1)//2), hidden_size)
+        self.fc3 = nn.Linear(hidden_size, output_size)
+        self.shape = tuple(state_shape)
+
+    @property
+    def input_size(self):
+        channels, height, width = self.shape
+        return channels*height*width
+
+    def forward(self, x):
+        single = x.dim() == 1
+        x = x.view(-1, *self.shape).float()
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2(x))
+        x = F.relu(self.fc1(x.flatten(1)))
+        x = self.fc3(x)
+        return x.squeeze(0) if single else x
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        hidden_size = state_dict['fc1.weight'].shape[0]
+        model = cls(state_dict['state_shape'].tolist(), hidden_size, state_dict['fc3.weight'].shape[0])
+        model.load_state_dict(state_dict)
+        return model
+
+    save = DQN.save
+
+
+def model_from_state_dict(state_dict):
+    # DQN or ConvDQN, whichever the checkpoint holds
+    if 'conv1.weight' in state_dict:
+        return ConvDQN.from_state_dict(state_dict)
+    return DQN.from_state_dict(state_dict)
+
+
+class InferencePolicy:
+    # Greedy action selection for a trained DQN without autograd.
+    # backend 'torch' runs the model under inference_mode on a preallocated input tensor,
+    # 'script' does the same with a TorchScript compiled copy, and 'numpy' runs fc1 -> relu -> fc3
+    # on exported weights with preallocated buffers. With memoize, Q-values are cached by the
+    # state read as a binary number, which is only valid for 0/1 state features like Snake's.
+
+    BACKENDS = ('torch', 'script', 'numpy')
+
+    def __init__(self, model, backend='numpy', memoize=False):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, use one of {self.BACKENDS}")
+        self.model = model
+        self.backend = backend
+        self.memoize = memoize
+        if backend == 'numpy' and not isinstance(model, DQN):
+            raise ValueError("The numpy backend only runs DQN models, use 'torch' or 'script'")
+        self.input_size = model.input_size
+        self.output_size = model.fc3.out_features
+        if memoize and self.input_size > 24:
+            raise ValueError("Memoization needs a binary state of at most 24 features")
+        self.refresh()
+
+    def refresh(self):
+        # call after the model weights change
+        self.x = np.zeros(self.input_size, dtype=np.float32)
+        self.q = np.zeros(self.output_size, dtype=np.float32)
+        if self.backend == 'numpy':
+            with torch.no_grad():
+                self.w1 = self.model.fc1.weight.numpy().T.copy()
+                self.b1 = self.model.fc1.bias.numpy().copy()
+                self.w3 = self.model.fc3.weight.numpy().T.copy()
+                self.b3 = self.model.fc3.bias.numpy().copy()
+            self.h = np.zeros(self.w1.shape[1], dtype=np.float32)
+        else:
+            self.x_tensor = torch.from_numpy(self.x)
+            self.forward_model = torch.jit.script(self.model) if self.backend == 'script' else self.model
+
+        if self.memoize:
+            self.powers = 1 << np.arange(self.input_size)
+            self.q_cache = np.zeros((1 << self.input_size, self.output_size), dtype=np.float32)
+            self.known = np.zeros(1 << self.input_size, dtype=bool)
+
+    def forward(self):
+        if self.backend == 'numpy':
+            np.dot(self.x, self.w1, out=self.h)
+            self.h += self.b1
+            np.maximum(self.h, 0, out=self.h)
+            np.dot(self.h, self.w3, out=self.q)
+            self.q += self.b3
+        else:
+            with torch.inference_mode():
+                self.q[:] = self.forward_model(self.x_tensor).numpy()
+        return self.q
+
+    def q_values(self, state):
+        state = np.asarray(state)[:self.input_size]
+        if self.memoize:
+            key = int(state @ self.powers)
+            if not self.known[key]:
+                self.x[:] = state
+                self.q_cache[key] = self.forward()
+                self.known[key] = True
+            return self.q_cache[key]
+        self.x[:] = state
+        return self.forward()
+
+    def act(self, state):
+        return int(self.q_values(state).argmax())
+
+
 class DQNTrainer:
-    def __init__(self, model, lr, gamma):
+    # Q-learning updates for a DQN. Bootstrap targets are computed without gradients, from a frozen
+    # copy of the model when target_update (hard copy every target_update updates) or tau
+    # (Polyak averaging after every update) is given, from the model itself otherwise.
+    # double picks the next action with the model and values it with the target network.
+
+    def __init__(self, model, lr, gamma, target_update=None, tau=None, double=False):
+        if double and not (target_update or tau):
+            raise ValueError("Double DQN needs a target network, set target_update or tau")
         self.lr = lr
         self.gamma = gamma
         self.model = model
         self.optimizer = optim.Adam(self.model.parameters(), lr=self.lr)
         self.loss_fn = nn.MSELoss()
 
+        self.target_update = target_update
+        self.tau = tau
+        self.double = double
+        self.updates = 0
+        self.td_errors = None
+        self.target_model = None
+        if target_update or tau:
+            self.target_model = copy.deepcopy(model)
+            self.target_model.requires_grad_(False)
+
+    def sync_target(self):
+        with torch.no_grad():
+            if self.tau:
+                for target_param, param in zip(self.target_model.parameters(), self.model.parameters()):
+                    target_param.lerp_(param, self.tau)
+            else:
+                self.target_model.load_state_dict(self.model.state_dict())
+
     def train_step(self, states, actions, rewards, next_states, game_overs):
-        
         if not isinstance(states, tuple):
-            states = torch.tensor(states, dtype=torch.float)
-            next_states = torch.tensor(next_states, dtype=torch.float)
-            actions = torch.tensor(actions, dtype=torch.long)
-            rewards = torch.tensor(rewards, dtype=torch.float)
-
-            states = torch.unsqueeze(states, 0)
-            next_states = torch.unsqueeze(next_states, 0)
-            actions = torch.unsqueeze(actions, 0)
-            rewards = torch.unsqueeze(rewards, 0)
+            states = (states,)
+            next_states = (next_states,)
+            actions = (actions,)
+            rewards = (rewards,)
             game_overs = (game_overs,)
-        
-        else:
-            states = torch.stack([torch.tensor(state, dtype=torch.float) for state in states])
-            next_states = torch.stack([torch.tensor(n_state, dtype=torch.float) for n_state in next_states])
-            actions = torch.stack([torch.tensor(action, dtype=torch.long) for action in actions])
-            rewards = torch.stack([torch.tensor(reward, dtype=torch.float) for reward in rewards])
-                                                #   a0, a1, a2, ..., an
-        pred = self.model(states) # self.model(s) = [ ,   ,   , ...,  ]
-        target = pred.clone() # target = prediction = model(s)
-        for idx in range(len(game_overs)): #game overs es un array de si el juego termino en esa combinacion de estados, acciones, etc
-            Q_new = rewards[idx]
-            if not game_overs[idx]:
-                Q_new = rewards[idx] + self.gamma * torch.max(self.model(next_states[idx])) # update de q learning, R_t+1 + gamma*max(q(s_t+1,a))
-            target[idx][torch.argmax(actions[idx]).item()] = Q_new
+
+        states = torch.stack([torch.as_tensor(state, dtype=torch.float) for state in states])
+        next_states = torch.stack([torch.as_tensor(n_state, dtype=torch.float) for n_state in next_states])
+        actions = torch.as_tensor(actions, dtype=torch.long)
+        rewards = torch.as_tensor(rewards, dtype=torch.float)
+        game_overs = torch.as_tensor(game_overs, dtype=torch.bool)
+        if actions.dim() == 2:
+            # one-hot actions
+            actions = actions.argmax(dim=1)
+
+        return self.update(states, actions, rewards, next_states, game_overs)
+
+    def update(self, states, action_idxs, rewards, next_states, game_overs, weights=None):
+        # states, next_states: (B, state_size) float, action_idxs: (B,) long, rewards: (B,) float, game_overs: (B,) bool
+        # weights: optional (B,) importance-sampling weights, the absolute TD errors are left in self.td_errors
+        with torch.no_grad():
+            if self.target_model is None:
+                next_q = self.model(next_states).max(dim=1).values
+            elif self.double:
+                next_actions = self.model(next_states).argmax(dim=1, keepdim=True)
+                next_q = self.target_model(next_states).gather(1, next_actions).squeeze(1)
+            else:
+                next_q = self.target_model(next_states).max(dim=1).values
+            # R_t+1 + gamma*max(q(s_t+1,a)), or just R_t+1 when the game ended there
+            Q_new = torch.where(game_overs, rewards, rewards + self.gamma * next_q)
+
+        pred = self.model(states)
+        target = pred.detach().clone()
+        target.scatter_(1, action_idxs.unsqueeze(1), Q_new.unsqueeze(1))
+
+        self.td_errors = (Q_new - pred.detach().gather(1, action_idxs.unsqueeze(1)).squeeze(1)).abs().numpy()
 
         self.optimizer.zero_grad()
-        loss = self.loss_fn(target, pred)
+        if weights is None:
+            loss = self.loss_fn(target, pred)
+        else:
+            loss = (weights.unsqueeze(1)*(target - pred)**2).mean()
         loss.backward()
-        self.optimizer.step()
\ No newline at end of file
+        self.optimizer.step()
+
+        self.updates += 1
+        if self.tau or (self.target_update and self.updates % self.target_update == 0):
+            self.sync_target()
+        return loss.item()
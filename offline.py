@@ -0,0 +1,225 @@
+import argparse
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, Tuple, Union
+
+import numpy as np
+import torch
+
+from batched_snake import BatchedSnake
+from model import DQN, DQNTrainer
+from replay import ReplayBuffer
+from trajectory import TrajectoryReader
+
+
+class BatchLoader:
+    # Samples batches from a ReplayBuffer or TrajectoryReader on a background thread,
+    # keeping up to prefetch of them queued so that the trainer never waits on indexing and unpacking.
+
+    def __init__(self, source, batch_size: int, n_batches: int, prefetch: int = 4):
+        self.source = source
+        self.batch_size = batch_size
+        self.n_batches = n_batches
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self) -> None:
+        try:
+            for _ in range(self.n_batches):
+                if not self.put(self.source.sample(self.batch_size)):
+                    return
+        except Exception as e:
+            self.put(e)
+            return
+        self.put(None)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self) -> None:
+        self.stop.set()
+        self.thread.join()
+
+
+def greedy_actions(states: np.ndarray, eps: float, rng: np.random.RandomState) -> np.ndarray:
+    # Scripted Snake policy on the 16-feature state: turn towards the food unless that cell is dangerous,
+    # with probability eps act at random instead.
+    directions = states[:, :4].argmax(axis=1)
+    new_directions = BatchedSnake.TURNS[directions]
+    rows = np.arange(len(states))[:, None]
+    towards_food = states[rows, 4 + new_directions]
+    danger = states[rows, 8 + new_directions]
+    scores = towards_food - 2*danger + 0.1*rng.random_sample(new_directions.shape)
+    actions = scores.argmax(axis=1)
+    explore = rng.random_sample(len(states)) < eps
+    actions[explore] = rng.randint(0, BatchedSnake.action_size, size=explore.sum())
+    return actions
+
+
+def generate_transitions(
+    n_transitions: int,
+    grid_wh: Tuple[int, int] = (20, 20),
+    x0: int = 3,
+    y0: int = 3,
+    initial_length: int = 3,
+    walls: bool = True,
+    policy: str = 'greedy',
+    eps: float = 0.2,
+    n_games: int = 1024,
+    seed: int = None
+    ) -> ReplayBuffer:
+
+    # plays n_games BatchedSnake games in lockstep with a random or greedy policy
+    if policy not in ('random', 'greedy'):
+        raise ValueError(f"Unknown policy {policy}, use 'random' or 'greedy'")
+
+    env = BatchedSnake(n_games, grid_wh, x0, y0, initial_length, walls=walls, seed=seed)
+    memory = ReplayBuffer(n_transitions, env.state_size)
+    rng = np.random.RandomState(seed)
+
+    states = env.get_state()
+    while len(memory) < n_transitions:
+        if policy == 'random':
+            actions = rng.randint(0, env.action_size, size=n_games)
+        else:
+            actions = greedy_actions(states, eps, rng)
+        # finished games come back already reset, their next state does not enter the Q target
+        next_states, rewards, dones, _ = env.step(actions)
+        n = min(n_games, n_transitions - len(memory))
+        memory.extend(states[:n], actions[:n], rewards[:n], next_states[:n], dones[:n])
+        states = next_states
+    return memory
+
+
+def train_offline(
+    source: Union[str, ReplayBuffer, TrajectoryReader],
+    n_updates: int = 10_000,
+    batch_size: int = 4096,
+    hidden_size: int = 256,
+    action_size: int = 3,
+    lr: float = 0.001,
+    gamma: float = 0.9,
+    model_filename: str = 'offline.pth',
+    init_model: str = None,
+    checkpoint_every: int = 1000,
+    prefetch: int = 4,
+    report_every: float = 5.,
+    n_threads: int = None,
+    seed: int = None
+    ) -> Dict[str, Any]:
+
+    # Fits a DQN on recorded transitions without stepping a game. source is a trajectory file path,
+    # a TrajectoryReader or a ReplayBuffer, checkpoints are written with DQN.save so GameAgent.load reads them.
+    if isinstance(source, str):
+        source = TrajectoryReader(source)
+    if not len(source):
+        raise ValueError("No transitions to train on")
+    if n_threads:
+        torch.set_num_threads(n_threads)
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+
+    if init_model:
+        model = DQN.from_state_dict(torch.load(init_model))
+    else:
+        model = DQN(source.state_size, hidden_size, action_size)
+    input_size = model.fc1.in_features
+    trainer = DQNTrainer(model, lr, gamma)
+
+    loader = BatchLoader(source, batch_size, n_updates, prefetch)
+    updates = 0
+    losses = []
+    wait_time = 0.
+    try:
+        start = last_report = time.perf_counter()
+        last_updates = 0
+        fetch_start = start
+        for states, action_idxs, rewards, next_states, game_overs in loader:
+            wait_time += time.perf_counter() - fetch_start
+            if states.shape[1] != input_size:
+                # e.g. a 12-input checkpoint fine-tuned on 16-feature data
+                states, next_states = states[:, :input_size], next_states[:, :input_size]
+            losses.append(trainer.update(states, action_idxs, rewards, next_states, game_overs))
+            updates += 1
+
+            if model_filename and updates % checkpoint_every == 0:
+                model.save(model_filename)
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                print(
+                    'Updates', updates, 'Loss:', round(np.mean(losses[last_updates:]), 4),
+                    'updates/sec', round((updates - last_updates)/(now - last_report), 1),
+                    'samples/sec', round(batch_size*(updates - last_updates)/(now - last_report))
+                )
+                last_report, last_updates = now, updates
+            fetch_start = time.perf_counter()
+    finally:
+        loader.close()
+
+    if model_filename:
+        model.save(model_filename)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'updates': updates,
+        'loss': losses[-1] if losses else None,
+        'updates_per_sec': updates/elapsed,
+        'samples_per_sec': batch_size*updates/elapsed,
+        'data_wait_share': wait_time/elapsed,
+        'model': model,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train a Snake DQN offline from a trajectory file or generated transitions")
+    data = parser.add_mutually_exclusive_group(required=True)
+    data.add_argument('--trajectory', help="trajectory file recorded with train(trajectory_path=...)")
+    data.add_argument('--generate', type=int, metavar='N', help="generate N transitions with BatchedSnake")
+    parser.add_argument('--policy', choices=('random', 'greedy'), default='greedy')
+    parser.add_argument('--grid', type=int, nargs=2, default=(20, 20), metavar=('W', 'H'))
+    parser.add_argument('--no-walls', dest='walls', action='store_false')
+    parser.add_argument('--updates', type=int, default=10_000)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--init-model', help="checkpoint to start from")
+    parser.add_argument('-o', '--model-filename', default='offline.pth', help="saved under ./model")
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        source = generate_transitions(args.generate, tuple(args.grid), walls=args.walls, policy=args.policy, seed=args.seed)
+    else:
+        source = args.trajectory
+
+    stats = train_offline(
+        source, args.updates, args.batch_size, args.hidden_size, model_filename=args.model_filename,
+        init_model=args.init_model, n_threads=args.threads, seed=args.seed
+    )
+    print({k: v for k, v in stats.items() if k != 'model'})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import numpy as np
+import torch
+
+
+class ReplayBuffer:
+    def __init__(self, capacity: int, state_size: int, state_dtype=np.uint8):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.states = np.zeros((capacity, state_size), dtype=state_dtype)
+        self.next_states = np.zeros((capacity, state_size), dtype=state_dtype)
+        self.actions = np.zeros(capacity, dtype=np.uint8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.game_overs = np.zeros(capacity, dtype=bool)
+
+        self.position = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, state, action: int, reward: float, next_state, game_over: bool) -> None:
+        pos = self.position
+        self.states[pos] = state
+        self.actions[pos] = action
+        self.rewards[pos] = reward
+        self.next_states[pos] = next_state
+        self.game_overs[pos] = game_over
+
+        self.position = (pos + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, states, actions, rewards, next_states, game_overs) -> None:
+        n = len(actions)
+        if n > self.capacity:
+            states, actions, rewards, next_states, game_overs = (
+                x[-self.capacity:] for x in (states, actions, rewards, next_states, game_overs)
+            )
+            n = self.capacity
+
+        idxs = (self.position + np.arange(n)) % self.capacity
+        self.states[idxs] = states
+        self.actions[idxs] = actions
+        self.rewards[idxs] = rewards
+        self.next_states[idxs] = next_states
+        self.game_overs[idxs] = game_overs
+
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample_idxs(self, batch_size: int) -> np.ndarray:
+        if self.size <= batch_size:
+            return np.arange(self.size)
+        return np.random.randint(0, self.size, size=batch_size)
+
+    def sample(self, batch_size: int):
+        # states, action_idxs, rewards, next_states, game_overs as DQNTrainer.update takes them
+        return self.get(self.sample_idxs(batch_size))
+
+    def get(self, idxs: np.ndarray):
+        return (
+            torch.from_numpy(self.states[idxs]).float(),
+            torch.from_numpy(self.actions[idxs]).long(),
+            torch.from_numpy(self.rewards[idxs]),
+            torch.from_numpy(self.next_states[idxs]).float(),
+            torch.from_numpy(self.game_overs[idxs]),
+        )
+
+
+class PackedReplayBuffer(ReplayBuffer):
+    # ReplayBuffer for large 0/1 observations such as board planes. States are bit-packed into a ring of frames
+    # and a transition whose state is the previous transition's next state shares its frame, so a step of
+    # play costs one frame. Frames run out before transitions when episodes are shorter than
+    # capacity/(frame_capacity - capacity) steps, the oldest transitions are then dropped early.
+
+    def __init__(self, capacity: int, state_size: int, frame_capacity: int = None):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.frame_capacity = frame_capacity or capacity + capacity//4 + 2
+        self.frames = np.zeros((self.frame_capacity, (state_size + 7)//8), dtype=np.uint8)
+        self.state_frames = np.zeros(capacity, dtype=np.int64)
+        self.next_frames = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.uint8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.game_overs = np.zeros(capacity, dtype=bool)
+
+        self.position = 0
+        self.size = 0
+        self.frame_position = 0
+        self.frames_used = 0
+        self.last_frame = None
+
+    def pack(self, state) -> np.ndarray:
+        if isinstance(state, torch.Tensor):
+            state = state.numpy()
+        return np.packbits(np.asarray(state) != 0, axis=-1, bitorder='little')
+
+    def write_frame(self, packed: np.ndarray) -> int:
+        frame = self.frame_position
+        if self.frames_used == self.frame_capacity:
+            # frames are handed out in order, only the oldest transitions can still point at the oldest frame
+            while self.size:
+                oldest = (self.position - self.size) % self.capacity
+                if self.state_frames[oldest] != frame and self.next_frames[oldest] != frame:
+                    break
+                self.size -= 1
+        else:
+            self.frames_used += 1
+        self.frames[frame] = packed
+        self.frame_position = (frame + 1) % self.frame_capacity
+        return frame
+
+    def append(self, state, action: int, reward: float, next_state, game_over: bool) -> None:
+        packed = self.pack(state)
+        if self.last_frame is not None and np.array_equal(self.frames[self.last_frame], packed):
+            state_frame = self.last_frame
+        else:
+            state_frame = self.write_frame(packed)
+        self.last_frame = self.write_frame(self.pack(next_state))
+
+        pos = self.position
+        self.state_frames[pos] = state_frame
+        self.next_frames[pos] = self.last_frame
+        self.actions[pos] = action
+        self.rewards[pos] = reward
+        self.game_overs[pos] = game_over
+
+        self.position = (pos + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, states, actions, rewards, next_states, game_overs) -> None:
+        for transition in zip(states, actions, rewards, next_states, game_overs):
+            self.append(*transition)
+
+    def sample_idxs(self, batch_size: int) -> np.ndarray:
+        # the live transitions are the size slots before position
+        if self.size <= batch_size:
+            offsets = np.arange(self.size)
+        else:
+            offsets = np.random.randint(0, self.size, size=batch_size)
+        return (self.position - self.size + offsets) % self.capacity
+
+    def unpack(self, frames: np.ndarray) -> np.ndarray:
+        return np.unpackbits(self.frames[frames], axis=-1, count=self.state_size, bitorder='little')
+
+    def get(self, idxs: np.ndarray):
+        return (
+            torch.from_numpy(self.unpack(self.state_frames[idxs])).float(),
+            torch.from_numpy(self.actions[idxs]).long(),
+            torch.from_numpy(self.rewards[idxs]),
+            torch.from_numpy(self.unpack(self.next_frames[idxs])).float(),
+            torch.from_numpy(self.game_overs[idxs]),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.frames, self.state_frames, self.next_frames, self.actions, self.rewards, self.game_overs))
+
+
+class SumTree:
+    # Array-backed binary tree whose leaves hold priorities and whose inner nodes hold the sum of
+    # their children. tree[1] is the root, node i has children 2i and 2i + 1, leaf j is node offset + j.
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.offset = 1 << max(0, (capacity - 1).bit_length())
+        self.depth = self.offset.bit_length() - 1
+        self.tree = np.zeros(2*self.offset, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return self.tree[1]
+
+    def __getitem__(self, idxs) -> np.ndarray:
+        return self.tree[self.offset + idxs]
+
+    def set(self, idx: int, priority: float) -> None:
+        # one leaf, walking up in python is cheaper than numpy calls for a single path
+        tree = self.tree
+        node = self.offset + idx
+        tree[node] = priority
+        node >>= 1
+        while node:
+            tree[node] = tree[2*node] + tree[2*node + 1]
+            node >>= 1
+
+    def update(self, idxs: np.ndarray, priorities: np.ndarray) -> None:
+        # a level at a time, parents shared by several leaves are written more than once with the same sum
+        nodes = self.offset + np.asarray(idxs, dtype=np.int64)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes >>= 1
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes + 1]
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        # leaf index of the prefix sum each value falls into, values must lie in [0, total)
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.depth):
+            nodes <<= 1
+            left = self.tree[nodes]
+            right = values >= left
+            values -= np.where(right, left, 0.)
+            nodes += right
+        return nodes - self.offset
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    # Proportional prioritized replay: transitions are sampled with probability p_i^alpha / sum_k p_k^alpha,
+    # p_i being the last absolute TD error of transition i plus eps, new transitions get the highest priority seen.
+    # Sampling is stratified, one draw in each of batch_size equal slices of the total priority.
+    # beta, the importance-sampling exponent, grows by beta_increment per sampled batch up to 1.
+
+    def __init__(
+        self,
+        capacity: int,
+        state_size: int,
+        state_dtype=np.uint8,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        beta_increment: float = 1e-4,
+        eps: float = 1e-3
+        ):
+
+        super().__init__(capacity, state_size, state_dtype)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.eps = eps
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.
+
+    def append(self, state, action: int, reward: float, next_state, game_over: bool) -> None:
+        self.tree.set(self.position, self.max_priority)
+        super().append(state, action, reward, next_state, game_over)
+
+    def extend(self, states, actions, rewards, next_states, game_overs) -> None:
+        n = min(len(actions), self.capacity)
+        self.tree.update((self.position + np.arange(n)) % self.capacity, self.max_priority)
+        super().extend(states, actions, rewards, next_states, game_overs)
+
+    def sample_idxs(self, batch_size: int) -> np.ndarray:
+        if self.size <= batch_size:
+            return np.arange(self.size)
+        self.beta = min(1., self.beta + self.beta_increment)
+        total = self.tree.total
+        values = (np.arange(batch_size) + np.random.random_sample(batch_size))*(total/batch_size)
+        # float drift between the tree levels can walk past the last filled leaf
+        return np.minimum(self.tree.find(np.minimum(values, np.nextafter(total, 0))), self.size - 1)
+
+    def weights(self, idxs: np.ndarray) -> torch.Tensor:
+        # importance-sampling weights (N*P(i))^-beta, scaled so that the largest is 1
+        probs = self.tree[idxs]/self.tree.total
+        weights = (self.size*probs)**-self.beta
+        return torch.from_numpy((weights/weights.max()).astype(np.float32))
+
+    def update_priorities(self, idxs: np.ndarray, td_errors: np.ndarray) -> None:
+        priorities = (np.abs(td_errors) + self.eps)**self.alpha
+        self.tree.update(idxs, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict
+
+import numpy as np
+
+
+class TickScheduler:
+    # Fixed-timestep clock for the game loop. Tick n is due at start + n/ups on the monotonic clock,
+    # so the time spent updating and rendering never shifts the ticks after it. A loop that wakes up late
+    # runs every tick that came due, at most max_catch_up of them, the older ones are skipped.
+    # Frames are decoupled from ticks, at most fps of them a second, after every wake-up that ran a tick otherwise.
+
+    def __init__(self, ups: float, max_catch_up: int = 5, fps: float = None, history: int = 10_000, clock: Callable[[], float] = time.monotonic):
+        self.period = 1/ups
+        self.frame_period = 1/fps if fps else 0.
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+
+        self.start = None
+        self.next_tick = 0
+        self.next_frame = 0.
+        self.ticks = 0
+        self.skipped = 0
+        self.frames = 0
+        self.keys = 0
+        # seconds a wake-up came after the deadline of the first tick it ran, and from reading a key to the frame showing it
+        self.jitter = deque(maxlen=history)
+        self.latency = deque(maxlen=history)
+        self.pending_keys = []
+
+    def deadline(self) -> float:
+        return self.start + self.next_tick*self.period
+
+    def due(self) -> int:
+        # how many ticks to run now
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        late = now - self.deadline()
+        if late < 0:
+            return 0
+        self.jitter.append(late)
+        n = int(late//self.period) + 1
+        if n > self.max_catch_up:
+            self.skipped += n - self.max_catch_up
+            self.next_tick += n - self.max_catch_up
+            n = self.max_catch_up
+        self.next_tick += n
+        self.ticks += n
+        return n
+
+    async def wait(self) -> None:
+        if self.start is not None:
+            await asyncio.sleep(max(0., self.deadline() - self.clock()))
+
+    def render_due(self) -> bool:
+        return self.clock() >= self.next_frame
+
+    def key_applied(self, read_time: float) -> None:
+        self.pending_keys.append(read_time)
+        self.keys += 1
+
+    def frame_rendered(self) -> None:
+        now = self.clock()
+        self.frames += 1
+        self.next_frame = now + self.frame_period
+        self.latency.extend(now - read_time for read_time in self.pending_keys)
+        self.pending_keys = []
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = self.clock() - self.start if self.start is not None else 0.
+        stats = {
+            'seconds': elapsed,
+            'ticks': self.ticks,
+            'skipped_ticks': self.skipped,
+            'frames': self.frames,
+            'keys': self.keys,
+            'target_ups': 1/self.period,
+            # tick 0 and the first frame come at start, so n of them span (n - 1) periods
+            'ups': self.ticks/(elapsed + self.period) if elapsed else 0.,
+            'fps': self.frames/(elapsed + self.period) if elapsed else 0.,
+        }
+        for name, values in (('jitter', self.jitter), ('input_latency', self.latency)):
+            values = np.array(values)*1000 if values else np.zeros(1)
+            stats[f'{name}_ms_mean'] = float(values.mean())
+            stats[f'{name}_ms_p99'] = float(np.percentile(values, 99))
+            stats[f'{name}_ms_max'] = float(values.max())
+        return stats
@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict
+
+import numpy as np
+
+from game import Game
+from snake import Snake
+
+
+# One event loop serves every connection, each one a Game with its own TickScheduler, key buffer and
+# frame stream. Connect a terminal with e.g.
+#   socat -,raw,echo=0 UNIX-CONNECT:/tmp/tty_games.sock
+
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), 'tty_games.sock')
+
+
+class SessionStream:
+    # What GameGrid.print writes to, a frame goes to the transport in one write on flush. writable is False
+    # while more than high_water bytes wait to be sent, Game.play then skips frames instead of queueing them.
+
+    def __init__(self, writer: asyncio.StreamWriter, high_water: int):
+        self.writer = writer
+        self.high_water = high_water
+        self.parts = []
+        self.bytes_written = 0
+        self.dropped_frames = 0
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+
+    def flush(self) -> None:
+        if self.parts:
+            data = ''.join(self.parts).replace('\n', '\r\n').encode()
+            self.parts = []
+            self.bytes_written += len(data)
+            self.writer.write(data)
+
+    def writable(self) -> bool:
+        transport = self.writer.transport
+        if transport.is_closing():
+            return False
+        if transport.get_write_buffer_size() > self.high_water:
+            self.dropped_frames += 1
+            return False
+        return True
+
+
+class Session:
+    def __init__(self, game: Game, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, high_water: int):
+        self.game = game
+        self.reader = reader
+        self.writer = writer
+        self.stream = SessionStream(writer, high_water)
+
+    async def read_keys(self) -> None:
+        while self.game.PLAY_CONDITION:
+            data = await self.reader.read(1024)
+            if not data:
+                self.game.PLAY_CONDITION = False
+                return
+            read_time = time.monotonic()
+            for key in data.decode(errors='ignore'):
+                self.game.key_pressed(key, read_time)
+
+    async def run(self) -> None:
+        keys = asyncio.create_task(self.read_keys())
+        try:
+            await self.game.play(self.stream, self.stream.writable)
+            self.stream.write(f"\n{self.game.HEADER} - game over\n")
+            self.stream.flush()
+        finally:
+            keys.cancel()
+            self.writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.game.scheduler.stats() if self.game.scheduler else {}
+        stats['bytes_written'] = self.stream.bytes_written
+        stats['dropped_frames'] = self.stream.dropped_frames
+        return stats
+
+
+class GameServer:
+    # Accepts connections on a unix socket or a localhost port and plays a game_factory() game on each,
+    # up to max_sessions at once.
+
+    def __init__(self, game_factory: Callable[[], Game], max_sessions: int = 1000, high_water: int = 64*1024):
+        self.game_factory = game_factory
+        self.max_sessions = max_sessions
+        self.high_water = high_water
+        self.sessions = set()
+        self.finished = []
+        self.peak_sessions = 0
+        self.start = time.monotonic()
+        self.cpu_start = time.process_time()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(b"Server full\r\n")
+            writer.close()
+            return
+        session = Session(self.game_factory(), reader, writer, self.high_water)
+        self.sessions.add(session)
+        self.peak_sessions = max(self.peak_sessions, len(self.sessions))
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+            self.finished.append(session.stats())
+
+    async def serve(self, path: str = None, port: int = None, stop: asyncio.Event = None) -> None:
+        if port is None:
+            if os.path.exists(path):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(self.handle, path, backlog=self.max_sessions)
+        else:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port, backlog=self.max_sessions)
+        stop = stop or asyncio.Event()
+        async with server:
+            await stop.wait()
+            for session in list(self.sessions):
+                session.game.PLAY_CONDITION = False
+            while self.sessions:
+                await asyncio.sleep(0.01)
+        if port is None and os.path.exists(path):
+            os.unlink(path)
+
+    def summary(self) -> Dict[str, Any]:
+        sessions = [stats for stats in self.finished if stats.get('ticks')]
+        summary = {
+            'sessions': len(self.finished),
+            'peak_sessions': self.peak_sessions,
+            'seconds': time.monotonic() - self.start,
+            'cpu_seconds': time.process_time() - self.cpu_start,
+        }
+        if sessions:
+            ups_error = np.array([stats['ups']/stats['target_ups'] - 1 for stats in sessions])
+            summary.update({
+                'ticks': int(sum(stats['ticks'] for stats in sessions)),
+                'skipped_ticks': int(sum(stats['skipped_ticks'] for stats in sessions)),
+                'dropped_frames': int(sum(stats['dropped_frames'] for stats in sessions)),
+                'ups_error_mean': float(ups_error.mean()),
+                'ups_error_worst': float(ups_error[np.abs(ups_error).argmax()]),
+                'jitter_ms_mean': float(np.mean([stats['jitter_ms_mean'] for stats in sessions])),
+                'jitter_ms_p99_worst': float(max(stats['jitter_ms_p99'] for stats in sessions)),
+                'input_latency_ms_mean': float(np.mean([stats['input_latency_ms_mean'] for stats in sessions if stats['keys']] or [0.])),
+            })
+            summary['cpu_us_per_tick'] = 1e6*summary['cpu_seconds']/max(summary['ticks'], 1)
+        return summary
+
+
+def serve(game_factory: Callable[[], Game], path: str = SOCKET_PATH, port: int = None, max_sessions: int = 1000) -> Dict[str, Any]:
+    # runs until SIGINT or SIGTERM, returns GameServer.summary
+    server = GameServer(game_factory, max_sessions)
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await server.serve(path, port, stop)
+
+    asyncio.run(main())
+    return server.summary()
+
+
+async def load_session(path: str, seconds: float, key_every: float, index: int) -> Dict[str, Any]:
+    # one client, turning up and right in turn so that the snake does not run into itself
+    start = time.monotonic()
+    reader, writer = await asyncio.open_unix_connection(path)
+    connect_time = time.monotonic() - start
+    keys = itertools.cycle('wd')
+    received = 0
+    first_byte = None
+    ended = False
+
+    async def press():
+        # spread over key_every so that the sessions do not all press at once
+        await asyncio.sleep(key_every*(index % 10)/10)
+        while True:
+            writer.write(next(keys).encode())
+            await asyncio.sleep(key_every)
+
+    presser = asyncio.create_task(press())
+    deadline = start + seconds
+    try:
+        while time.monotonic() < deadline:
+            try:
+                data = await asyncio.wait_for(reader.read(65536), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                ended = True
+                break
+            if first_byte is None:
+                first_byte = time.monotonic() - start
+            received += len(data)
+    finally:
+        presser.cancel()
+        if not ended:
+            writer.write(b'q')
+            await reader.read()
+        writer.close()
+    return {
+        'connect_ms': 1000*connect_time,
+        'first_frame_ms': 1000*first_byte if first_byte is not None else None,
+        'bytes_per_sec': received/seconds,
+        'ended_early': ended,
+    }
+
+
+def load_test(
+    n_sessions: int = 100,
+    seconds: float = 10.,
+    key_every: float = 0.2,
+    grid_wh=(60, 30),
+    ups: int = 20,
+    path: str = None
+    ) -> Dict[str, Any]:
+
+    # Without a path a server is started in a subprocess, which also gives its CPU time and
+    # the per-session tick statistics it prints when stopped.
+    server = None
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'load.sock')
+        server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve', '--socket', path, '--grid', *map(str, grid_wh),
+             '--ups', str(ups), '--no-walls', '--max-sessions', str(n_sessions), '--json'],
+            stdout=subprocess.PIPE, text=True
+        )
+        while not os.path.exists(path):
+            if server.poll() is not None:
+                raise RuntimeError("Game server did not start")
+            time.sleep(0.05)
+
+    async def main():
+        return await asyncio.gather(*(load_session(path, seconds, key_every, i) for i in range(n_sessions)))
+
+    clients = asyncio.run(main())
+    report = {
+        'sessions': n_sessions,
+        'seconds': seconds,
+        'ups': ups,
+        'grid_wh': list(grid_wh),
+        'connect_ms_p99': float(np.percentile([c['connect_ms'] for c in clients], 99)),
+        'first_frame_ms_p99': float(np.percentile([c['first_frame_ms'] or np.inf for c in clients], 99)),
+        'bytes_per_sec_per_session': float(np.mean([c['bytes_per_sec'] for c in clients])),
+        'ended_early': sum(c['ended_early'] for c in clients),
+    }
+    if server:
+        server.send_signal(signal.SIGINT)
+        output, _ = server.communicate()
+        summary = json.loads(output.strip().splitlines()[-1])
+        report['server'] = summary
+        # share of one core each session took
+        report['cpu_per_session'] = summary['cpu_seconds']/(n_sessions*summary['seconds'])
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Snake games to many terminals from one process, or load test a server")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="accept connections until interrupted")
+    serve_parser.add_argument('--socket', default=SOCKET_PATH, help="unix socket path")
+    serve_parser.add_argument('--port', type=int, help="listen on this localhost TCP port instead")
+    serve_parser.add_argument('--grid', type=int, nargs=2, default=(20, 20), metavar=('W', 'H'))
+    serve_parser.add_argument('--ups', type=int, default=10)
+    serve_parser.add_argument('--no-walls', dest='walls', action='store_false')
+    serve_parser.add_argument('--special', action='store_true')
+    serve_parser.add_argument('--max-sessions', type=int, default=1000)
+    serve_parser.add_argument('--json', action='store_true', help="print the summary as one JSON line")
+    load_parser = commands.add_parser('load', help="open N sessions and report tick rate and CPU cost")
+    load_parser.add_argument('-n', '--sessions', type=int, default=100)
+    load_parser.add_argument('--seconds', type=float, default=10.)
+    load_parser.add_argument('--grid', type=int, nargs=2, default=(60, 30), metavar=('W', 'H'))
+    load_parser.add_argument('--ups', type=int, default=20)
+    load_parser.add_argument('--socket', help="load an already running server, by default one is started")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        grid_wh = tuple(args.grid)
+        factory = lambda: Snake(grid_wh, 3, 3, 3, ups=args.ups, special=args.special, walls=args.walls)
+        summary = serve(factory, args.socket, args.port, args.max_sessions)
+        print(json.dumps(summary) if args.json else json.dumps(summary, indent=2))
+    else:
+        print(json.dumps(load_test(args.sessions, args.seconds, grid_wh=tuple(args.grid), ups=args.ups, path=args.socket), indent=2))
+
+
+if __name__ == "__main__":
+    main()
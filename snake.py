@@ -1,3 +1,6 @@
+from collections import Counter, deque
+from itertools import islice
+
 from game import TrainableGame
 import numpy as np
 
@@ -47,12 +50,44 @@ class Snake(TrainableGame):
             ('right', (0, 1, 0)): 's',
             ('', (0, 0, 1)): 'none'
         }
+
+    # MAPPING by direction and action index, None keeps the current direction
+    TURN_KEYS = {
+        'up': ['a', 'd', None],
+        'down': ['d', 'a', None],
+        'left': ['s', 'w', None],
+        'right': ['w', 's', None]
+    }
+
+    STATE_DTYPE = np.uint8
+
+    DIRECTION_BITS = {
+        'up': 1 << 0,
+        'down': 1 << 1,
+        'left': 1 << 2,
+        'right': 1 << 3
+    }
+
+    STATE_SHIFTS = np.arange(16)
+
+    # 1 is the 12-feature state the checkpoints in model/ were trained on, 2 adds the distance-2 danger bits,
+    # 3 is the planes observation
+    STATE_VERSION = 2
+
+    OBSERVATIONS = ('features', 'planes')
+
+    # planes observation channels, each a (height + 2, width + 2) board whose outer ring is the wall
+    PLANES = ('body', 'head', 'food', 'special', 'walls')
+
+    SPARSE_GRID = True
         
     
-    def __init__(self, grid_wh, x0, y0, initial_length=3, ups=10, special=False, walls=True):
+    def __init__(self, grid_wh, x0, y0, initial_length=3, ups=10, special=False, walls=True, observation='features'):
         super().__init__(grid_wh, ups)
         if initial_length > self.grid.width:
             raise ValueError("Initial length is greater than grid width")
+        if observation not in self.OBSERVATIONS:
+            raise ValueError(f"Unknown observation {observation}, use one of {self.OBSERVATIONS}")
 
         self.special = special
         self.walls = walls
@@ -60,6 +95,33 @@ class Snake(TrainableGame):
         self.direction = 'right'
         self.x0, self.y0 = x0, y0 
         self.initial_length = initial_length
+
+        # cell -> number of body segments on it, the body may hold duplicates while growing
+        self.occupancy = {}
+        # flat ids y*width + x of the cells with no body on them, the first n_free of free_cells.
+        # free_index holds the position of each free cell in free_cells, stale for the others
+        n_cells = self.grid.width*self.grid.height
+        self.free_cells = np.arange(n_cells, dtype=np.int32)
+        self.free_index = np.arange(n_cells, dtype=np.int32)
+        self.n_free = n_cells
+        # cells whose occupancy went to or from zero and the head, food and eating cells, since the last update_cells
+        self.dirty = set()
+        self.overlay = set()
+        self.body = deque()
+
+        # with observation='planes' the board is kept as uint8 channels updated in place, the body channel
+        # by claim and release, the head, food and special cells by get_state
+        self.observation = observation
+        self.planes = None
+        if observation == 'planes':
+            self.planes = np.zeros((len(self.PLANES), self.grid.height + 2, self.grid.width + 2), dtype=np.uint8)
+            if walls:
+                walls_plane = self.planes[self.PLANES.index('walls')]
+                walls_plane[[0, -1], :] = 1
+                walls_plane[:, [0, -1]] = 1
+            self.marks = []
+            self.STATE_SHAPE = self.planes.shape
+            self.STATE_VERSION = 3
         self.initialize_body(self.x0, self.y0, self.initial_length)
 
 
@@ -68,15 +130,69 @@ class Snake(TrainableGame):
         if special:
             self.to_eat_special = []
         self.score = 0
+        self.won = False
         self.PLAY_CONDITION = True
 
+        self.invalidate_state()
         self.state_size = self.get_state().shape[0]
 
     def initialize_body(self, x0, y0, initial_length):
-        self.body = [(x, y0) for x in [x0-i % self.grid.width for i in range(initial_length)]][::-1]
+        self.set_body([(x, y0) for x in [x0-i % self.grid.width for i in range(initial_length)]][::-1])
+
+    def set_body(self, cells):
+        old = self.occupancy
+        self.body = deque(cells)
+        self.occupancy = dict(Counter(self.body))
+        # only the cells that changed hands touch the free-cell index
+        for cell in old.keys() - self.occupancy.keys():
+            self.release(cell)
+        for cell in self.occupancy.keys() - old.keys():
+            self.claim(cell)
+
+    def occupy(self, cell):
+        count = self.occupancy.get(cell, 0)
+        self.occupancy[cell] = count + 1
+        if not count:
+            self.claim(cell)
+
+    def vacate(self, cell):
+        count = self.occupancy.pop(cell) - 1
+        if count:
+            self.occupancy[cell] = count
+        else:
+            self.release(cell)
+
+    def on_grid(self, cell):
+        return 0 <= cell[0] < self.grid.width and 0 <= cell[1] < self.grid.height
+
+    def claim(self, cell):
+        # swap-remove cell from free_cells, off-grid cells were never in it
+        self.dirty.add(cell)
+        if self.on_grid(cell):
+            if self.planes is not None:
+                self.planes[0, cell[1] + 1, cell[0] + 1] = 1
+            idx = self.free_index[cell[1]*self.grid.width + cell[0]]
+            self.n_free -= 1
+            last = self.free_cells[self.n_free]
+            self.free_cells[idx] = last
+            self.free_index[last] = idx
+
+    def release(self, cell):
+        self.dirty.add(cell)
+        if self.on_grid(cell):
+            if self.planes is not None:
+                self.planes[0, cell[1] + 1, cell[0] + 1] = 0
+            cell_id = cell[1]*self.grid.width + cell[0]
+            self.free_cells[self.n_free] = cell_id
+            self.free_index[cell_id] = self.n_free
+            self.n_free += 1
+
+    def random_free_cell(self):
+        y, x = divmod(int(self.free_cells[np.random.randint(self.n_free)]), self.grid.width)
+        return x, y
  
     def is_dead(self):
-        if self.body[-1] in self.body[:-1]:
+        if self.occupancy[self.body[-1]] > 1:
             return True
         if self.walls:
             if self.body[-1][0] < 0 or self.body[-1][0] >= self.grid.width:
@@ -87,12 +203,14 @@ class Snake(TrainableGame):
     
     def update_food(self):
         if not self.to_eat:
-            while True:
-                x = np.random.randint(0, self.grid.width)
-                y = np.random.randint(0, self.grid.height)
-                if (x,y) not in self.body:
-                    self.to_eat = [(x,y)]
-                    break
+            if not self.n_free:
+                # the snake covers the whole board
+                self.won = True
+                return
+            self.to_eat = [self.random_free_cell()]
+            if self.state_bits is not None:
+                self.state_bits = self.state_bits & ~0xF0 | self.food_bits()
+            self.state_array = None
     
     def update_special(self):
         if self.to_eat_special:
@@ -100,22 +218,18 @@ class Snake(TrainableGame):
             if self.special_countdown == 0:
                 self.to_eat_special.pop(0)
 
-        if not self.to_eat_special and (self.score % 5 == 0) and self.score:
-            while True:
-                x = np.random.randint(0, self.grid.width)
-                y = np.random.randint(0, self.grid.height)
-                if (x,y) not in self.body:
-                    self.to_eat_special = [(x,y)]
-                    self.special_countdown = self.UPDATE_PER_SECOND*5
-                    break
+        if not self.to_eat_special and (self.score % 5 == 0) and self.score and self.n_free:
+            self.to_eat_special = [self.random_free_cell()]
+            self.special_countdown = self.UPDATE_PER_SECOND*5
             
     def update_body(self):
         if self.body[0] in self.eating:
             self.eating.pop(0)
-            self.body.pop(0)
-            self.body.insert(0, self.body[0])
+            self.vacate(self.body.popleft())
+            self.body.appendleft(self.body[0])
+            self.occupy(self.body[0])
         else:
-            self.body.pop(0)
+            self.vacate(self.body.popleft())
 
         xx, yy = self.UPDATE_MAP[self.direction]
 
@@ -129,6 +243,7 @@ class Snake(TrainableGame):
                 (self.body[-1][0] + xx) % self.grid.width,
                 (self.body[-1][1] + yy) % self.grid.height
             ))
+        self.occupy(self.body[-1])
 
         if self.body[-1] in self.to_eat:
             self.score += 1
@@ -141,11 +256,17 @@ class Snake(TrainableGame):
                 self.eating.append(self.body[-1])
                 self.to_eat_special.pop(0)
 
+        self.invalidate_state()
+
     def update_header(self):
         self.HEADER = f"Score: {self.score}"
 
     def update_game(self):
         self.update_food()
+        if self.won:
+            self.PLAY_CONDITION = False
+            self.HEADER = f"Score: {self.score} - board cleared!"
+            return
         if self.special:
             self.update_special()
         self.update_body()
@@ -153,8 +274,14 @@ class Snake(TrainableGame):
         if self.is_dead():
             self.PLAY_CONDITION = False
         
+    def trace(self):
+        # the body is the last `length` cells the head went through, the front segment is doubled while growing
+        length = len(self.body) - (len(self.body) > 1 and self.body[0] == self.body[1])
+        food_x, food_y = self.to_eat[0] if self.to_eat else (-1, -1)
+        return (*self.body[-1], food_x, food_y, length)
+
     def update_grid(self):
-        for x,y in self.body[:-1]:
+        for x,y in islice(self.body, len(self.body)-1):
 
             self.grid.grid[y,x] = '⬤'
 
@@ -173,6 +300,57 @@ class Snake(TrainableGame):
                 x,y = self.to_eat_special[0]
                 self.grid.grid[y,x] = '🐭'
 
+    def cell_char(self, cell):
+        # what update_grid leaves on a cell, later draws there win
+        if self.special and self.to_eat_special and self.special_countdown > 0 and cell == self.to_eat_special[0]:
+            return '🐭'
+        if cell in self.to_eat:
+            return '@'
+        if cell == self.body[-1]:
+            return self.HEAD_MAP[self.direction]
+        if cell in self.eating:
+            return 'x'
+        if cell in self.occupancy:
+            return '⬤'
+        return ' '
+
+    def update_cells(self, full):
+        overlay = {self.body[-1], *self.eating, *self.to_eat}
+        if self.special and self.to_eat_special:
+            overlay.add(self.to_eat_special[0])
+        if full:
+            cells = overlay.union(self.occupancy)
+        else:
+            cells = overlay.union(self.dirty, self.overlay)
+        self.dirty = set()
+        self.overlay = overlay
+        return [(cell[0], cell[1], self.cell_char(cell)) for cell in cells if self.on_grid(cell)]
+
+    def focus(self):
+        return self.body[-1]
+
+    def snapshot(self):
+        # the body tuple shares its cell tuples with the deque, a frame costs a pointer per segment
+        special = (tuple(self.to_eat_special), getattr(self, 'special_countdown', 0)) if self.special else None
+        return tuple(self.body), tuple(self.to_eat), tuple(self.eating), special, self.direction, self.HEADER
+
+    def show_snapshot(self, snapshot):
+        # only what drawing reads is restored, the free-cell index is left alone so that replaying does
+        # not change where food appears next. Showing the live board's snapshot last makes it whole again
+        body, to_eat, eating, special, direction, header = snapshot
+        old = self.occupancy
+        self.body = deque(body)
+        self.occupancy = dict(Counter(self.body))
+        self.dirty.update(old.keys() ^ self.occupancy.keys())
+        self.to_eat = list(to_eat)
+        self.eating = list(eating)
+        if self.special:
+            to_eat_special, self.special_countdown = special
+            self.to_eat_special = list(to_eat_special)
+        self.direction = direction
+        self.HEADER = header
+        self.invalidate_state()
+
     def on_key_press(self, key):
         if key in self.DIRECTION_MAP.keys():
             self.change_direction(key)
@@ -180,54 +358,77 @@ class Snake(TrainableGame):
     def change_direction(self, new_direction):
         if (self.direction, new_direction) not in self.PROHIBITED_NEW_DIRECTIONS:
             self.direction = self.DIRECTION_MAP[new_direction]
+            if self.state_bits is not None:
+                self.state_bits = self.state_bits & ~0xF | self.DIRECTION_BITS[self.direction]
+            self.state_array = None
 
     def get_state(self):
-        dir_u = self.direction == 'up'
-        dir_d = self.direction == 'down'
-        dir_l = self.direction == 'left'
-        dir_r = self.direction == 'right'
-
-        if self.to_eat:
-            food_up = self.body[-1][1] > self.to_eat[0][1]
-            food_down = self.body[-1][1] < self.to_eat[0][1]
-            food_left = self.body[-1][0] > self.to_eat[0][0]
-            food_right = self.body[-1][0] < self.to_eat[0][0]
-        else:
-            food_up = food_down = food_left = food_right = False
-        
+        if self.planes is not None:
+            return self.get_planes()
+        # the features are kept packed in state_bits, bit i holding feature i of
+        # [dir_u, dir_d, dir_l, dir_r, food_up, food_down, food_left, food_right,
+        #  danger_up, danger_down, danger_left, danger_right, danger_up_2, danger_down_2, danger_left_2, danger_right_2]
+        # the unpacked array is cached until the next change and must not be modified
+        if self.state_array is None:
+            self.state_array = (self.get_state_bits() >> self.STATE_SHIFTS) & 1
+            self.state_array.flags.writeable = False
+        return self.state_array
+
+    def get_planes(self):
+        # flat read-only view of self.planes, it changes with the game so callers that keep it copy it first.
+        # It is made on every call since a view kept as an attribute comes back from pickle as a copy
+        planes = self.planes
+        for channel, y, x in self.marks:
+            planes[channel, y, x] = 0
+        marks = [(1, *self.body[-1][::-1])]
+        marks += [(2, y, x) for x, y in self.to_eat]
+        if self.special and self.to_eat_special and self.special_countdown > 0:
+            marks.append((3, *self.to_eat_special[0][::-1]))
+        height, width = planes.shape[1:]
+        # a head that went through a wall sits on the wall ring
+        self.marks = [(channel, y + 1, x + 1) for channel, y, x in marks if -1 <= x < width - 1 and -1 <= y < height - 1]
+        for channel, y, x in self.marks:
+            planes[channel, y, x] = 1
+        view = planes.reshape(-1)
+        view.flags.writeable = False
+        return view
+
+    def get_state_bits(self):
+        # None after a move, the food and danger features are only looked up once they are asked for
+        if self.state_bits is None:
+            self.state_bits = self.DIRECTION_BITS[self.direction] | self.food_bits() | self.danger_bits()
+        return self.state_bits
+
+    def invalidate_state(self):
+        self.state_bits = None
+        self.state_array = None
+
+    def food_bits(self):
+        if not self.to_eat:
+            return 0
         head_x, head_y = self.body[-1]
-
-        danger_up = (head_x, (head_y - 1) % self.grid.height) in self.body
-        danger_down = (head_x, (head_y + 1) % self.grid.height) in self.body
-        danger_left = ((head_x - 1) % self.grid.width, head_y) in self.body
-        danger_right = ((head_x + 1) % self.grid.width, head_y) in self.body
-        danger_up_2 = (head_x, (head_y - 2) % self.grid.height) in self.body
-        danger_down_2 = (head_x, (head_y + 2) % self.grid.height) in self.body
-        danger_left_2 = ((head_x - 2) % self.grid.width, head_y) in self.body
-        danger_right_2 = ((head_x + 2) % self.grid.width, head_y) in self.body
-        
-
-
-        state = [
-            dir_u,
-            dir_d,
-            dir_l,
-            dir_r,
-            food_up,
-            food_down,
-            food_left,
-            food_right,
-            danger_up,
-            danger_down,
-            danger_left,
-            danger_right,
-            danger_up_2,
-            danger_down_2,
-            danger_left_2,
-            danger_right_2
-        ]
-
-        return np.array(state, dtype=int)
+        food_x, food_y = self.to_eat[0]
+        return (
+            (head_y > food_y) << 4
+            | (head_y < food_y) << 5
+            | (head_x > food_x) << 6
+            | (head_x < food_x) << 7
+        )
+
+    def danger_bits(self):
+        head_x, head_y = self.body[-1]
+        width, height = self.grid.width, self.grid.height
+        occupancy = self.occupancy
+        return (
+            ((head_x, (head_y - 1) % height) in occupancy) << 8
+            | ((head_x, (head_y + 1) % height) in occupancy) << 9
+            | (((head_x - 1) % width, head_y) in occupancy) << 10
+            | (((head_x + 1) % width, head_y) in occupancy) << 11
+            | ((head_x, (head_y - 2) % height) in occupancy) << 12
+            | ((head_x, (head_y + 2) % height) in occupancy) << 13
+            | (((head_x - 2) % width, head_y) in occupancy) << 14
+            | (((head_x + 2) % width, head_y) in occupancy) << 15
+        )
 
     def reset(self, train=False):
         if train:
@@ -239,15 +440,21 @@ class Snake(TrainableGame):
         self.eating = []
         self.to_eat = []
         self.score = 0
+        self.won = False
         self.PLAY_CONDITION = True
+        self.invalidate_state()
         
     def play_step(self, action):
-        self.on_key_press(self.map_action(action))
+        key = self.map_action(action)
+        if key:
+            self.on_key_press(key)
         score_before = self.score
         self.update_game()
         score_after = self.score
 
-        if self.PLAY_CONDITION == False:
+        if self.won:
+            return 10, True, self.score
+        elif self.PLAY_CONDITION == False:
             reward = -10
             game_over = True
             return reward, game_over, self.score
@@ -259,6 +466,9 @@ class Snake(TrainableGame):
         return -0.05, False, self.score
         
     def map_action(self, action):
+        if isinstance(action, (int, np.integer)):
+            return self.TURN_KEYS[self.direction][action]
+        # one-hot actions go through MAPPING, anything that is not one of its rows keeps the direction
         return self.MAPPING.get((self.direction, tuple(action)), None)
 
 
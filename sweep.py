@@ -0,0 +1,203 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Dict, List
+
+import torch
+
+from agent import GameAgent
+from snake import Snake
+
+
+# A search space maps GameAgent parameters to a list of values or to a (low, high) range, (low, high, 'log')
+# for a log-uniform one. Ranges are sampled as floats unless both ends are ints.
+DEFAULT_SPACE = {
+    'hidden_size': [64, 128, 256],
+    'lr': (1e-4, 1e-2, 'log'),
+    'gamma': [0.8, 0.9, 0.95],
+    'batch_size': [256, 1000],
+    'train_every': [None, 4],
+}
+
+GAME_CONFIG = {'grid_wh': (10, 10), 'x0': 3, 'y0': 3, 'initial_length': 3, 'walls': True}
+
+
+def sample_space(space: Dict[str, Any], n_trials: int = None, seed: int = 0) -> List[Dict[str, Any]]:
+    # every combination when n_trials is None and the space only has lists, n_trials random draws otherwise
+    if n_trials is None:
+        if not all(isinstance(values, list) for values in space.values()):
+            raise ValueError("A grid search needs a list of values for every parameter, give n_trials for ranges")
+        return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+    rng = random.Random(seed)
+    trials = []
+    for _ in range(n_trials):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, list):
+                params[name] = rng.choice(values)
+            elif len(values) == 3 and values[2] == 'log':
+                params[name] = math.exp(rng.uniform(math.log(values[0]), math.log(values[1])))
+            elif isinstance(values[0], int) and isinstance(values[1], int):
+                params[name] = rng.randint(values[0], values[1])
+            else:
+                params[name] = rng.uniform(values[0], values[1])
+        trials.append(params)
+    return trials
+
+
+def parse_space(text: str) -> Dict[str, Any]:
+    # JSON has no tuples, ranges are written {"range": [low, high]} or {"log": [low, high]}
+    space = {}
+    for name, values in json.loads(text).items():
+        if isinstance(values, dict):
+            (kind, (low, high)), = values.items()
+            values = (low, high, 'log') if kind == 'log' else (low, high)
+        space[name] = values
+    return space
+
+
+def run_trial(trial_id: int, params: Dict[str, Any], game_config: Dict[str, Any], games: int, checkpoint: str, seed: int) -> Dict[str, Any]:
+    # trains a trial for `games` more games, picking up from its checkpoint when there is one
+    game = Snake(**game_config)
+    game.set_map_actions()
+    agent = GameAgent(game, **params)
+    if os.path.exists(checkpoint):
+        agent.restore(checkpoint)
+
+    stats = game.train(
+        watch_training=False, max_games=games, model_filename=None, agent=agent, verbose=False,
+        seed=seed + 1000*trial_id + agent.n_games
+    )
+    agent.checkpoint(checkpoint)
+    return {
+        'trial': trial_id,
+        'games': agent.n_games,
+        'mean_score': stats['mean_score'],
+        'record': stats['record'],
+        'seconds': stats['seconds'],
+    }
+
+
+def run_job(job) -> Dict[str, Any]:
+    threads, *args = job
+    torch.set_num_threads(threads)
+    return run_trial(*args)
+
+
+def successive_halving(
+    space: Dict[str, Any] = DEFAULT_SPACE,
+    n_trials: int = 27,
+    min_games: int = 50,
+    max_games: int = 1350,
+    eta: int = 3,
+    game_config: Dict[str, Any] = GAME_CONFIG,
+    out_dir: str = 'sweeps/sweep',
+    n_workers: int = None,
+    threads: int = None,
+    seed: int = 0
+    ) -> List[Dict[str, Any]]:
+
+    # Every trial trains min_games games, the best 1/eta by mean score over those games train eta times as
+    # many, and so on up to max_games. Trials are checkpointed between rungs and run in a spawn process pool,
+    # each worker limited to `threads` torch threads so that the pool does not oversubscribe the cores.
+    os.makedirs(out_dir, exist_ok=True)
+    trials = sample_space(space, n_trials, seed)
+    n_workers = n_workers or min(len(trials), os.cpu_count() or 1)
+    threads = threads or max(1, (os.cpu_count() or 1)//n_workers)
+    checkpoints = [os.path.join(out_dir, f'trial_{i}.pt') for i in range(len(trials))]
+    for path in checkpoints:
+        if os.path.exists(path):
+            os.remove(path)
+
+    results = [{'trial': i, **params, 'rung': 0, 'games': 0, 'mean_score': None, 'record': 0, 'seconds': 0.} for i, params in enumerate(trials)]
+    survivors = list(range(len(trials)))
+    rung_games = min_games
+    rung = 0
+    start = time.perf_counter()
+    pool = ProcessPoolExecutor(n_workers, mp_context=mp.get_context('spawn')) if n_workers > 1 else None
+    with pool or nullcontext():
+        while True:
+            jobs = [
+                (threads, i, trials[i], game_config, rung_games - results[i]['games'], checkpoints[i], seed)
+                for i in survivors
+            ]
+            for trial in (pool.map if pool else map)(run_job, jobs):
+                result = results[trial['trial']]
+                result.update(rung=rung, games=trial['games'], mean_score=trial['mean_score'], seconds=result['seconds'] + trial['seconds'])
+                result['record'] = max(result['record'], trial['record'])
+
+            ranked = sorted(survivors, key=lambda i: results[i]['mean_score'], reverse=True)
+            print(
+                f"rung {rung}: {len(survivors)} trials at {rung_games} games, best mean score {results[ranked[0]]['mean_score']:.2f}"
+                f" (trial {ranked[0]}), {time.perf_counter() - start:.0f}s"
+            )
+            if rung_games >= max_games or len(survivors) == 1:
+                break
+            survivors = ranked[:max(1, len(survivors)//eta)]
+            rung_games = min(rung_games*eta, max_games)
+            rung += 1
+
+    # the best trial's weights load with GameAgent.load, the other checkpoints are only needed to resume
+    best = max(survivors, key=lambda i: results[i]['mean_score'])
+    state = torch.load(checkpoints[best], weights_only=False)
+    torch.save(state['model'], os.path.join(out_dir, 'best.pth'))
+    for path in checkpoints:
+        if os.path.exists(path):
+            os.remove(path)
+
+    results.sort(key=lambda r: (-r['rung'], -(r['mean_score'] or 0)))
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    return results
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    columns = list(results[0])
+    rows = [columns]
+    for result in results:
+        rows.append([
+            f'{value:.4g}' if isinstance(value, float) else str(value)
+            for value in (result[name] for name in columns)
+        ])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep over TrainableGame.train with successive halving")
+    parser.add_argument('--space', help='JSON search space, e.g. {"lr": {"log": [1e-4, 1e-2]}, "hidden_size": [64, 256]}')
+    parser.add_argument('--trials', type=int, default=27, help="random trials, 0 for every combination of a list-only space")
+    parser.add_argument('--min-games', type=int, default=50)
+    parser.add_argument('--max-games', type=int, default=1350)
+    parser.add_argument('--eta', type=int, default=3, help="keep the best 1/eta trials at every rung")
+    parser.add_argument('--grid', type=int, nargs=2, default=(10, 10), metavar=('W', 'H'))
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', type=int, help="torch threads per worker")
+    parser.add_argument('-o', '--out-dir', default='sweeps/sweep')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    space = parse_space(args.space) if args.space else DEFAULT_SPACE
+    game_config = {**GAME_CONFIG, 'grid_wh': tuple(args.grid)}
+
+    results = successive_halving(
+        space, args.trials or None, args.min_games, args.max_games, args.eta, game_config,
+        args.out_dir, args.workers, args.threads, args.seed
+    )
+    print(format_table(results))
+    print(f"results in {os.path.join(args.out_dir, 'results.csv')}, best weights in {os.path.join(args.out_dir, 'best.pth')}")
+
+
+if __name__ == "__main__":
+    main()
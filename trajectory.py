@@ -0,0 +1,288 @@
+import argparse
+import os
+import sys
+import time
+from typing import Iterator, Tuple
+
+import numpy as np
+import torch
+
+from snake import Snake
+
+
+# A trajectory file is a HEADER_SIZE byte header followed by fixed-width records, one per step.
+# States are 0/1 features packed 8 to a byte, little endian bit order, so a 16-feature Snake
+# transition takes 21 bytes. Records are only ever appended, a torn last record is ignored.
+
+MAGIC = b'TTYTRAJ\x00'
+VERSION = 1
+HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u2'),
+    ('game', 'S16'),
+    ('state_version', '<u2'),
+    ('state_size', '<u2'),
+    ('width', '<u2'),
+    ('height', '<u2'),
+    ('x0', '<i2'),
+    ('y0', '<i2'),
+    ('walls', 'u1'),
+    ('seed', '<i8'),
+])
+
+# the fields that have to match to append to an existing file
+COMPATIBLE_FIELDS = ('game', 'state_version', 'state_size', 'width', 'height')
+
+
+def record_dtype(state_size: int) -> np.dtype:
+    # head, food and length describe the board after the step, see TrainableGame.trace
+    state_bytes = (state_size + 7)//8
+    return np.dtype([
+        ('state', 'u1', (state_bytes,)),
+        ('next_state', 'u1', (state_bytes,)),
+        ('action', 'u1'),
+        ('done', 'u1'),
+        ('last', 'u1'),
+        ('reward', '<f4'),
+        ('head', '<i2', (2,)),
+        ('food', '<i2', (2,)),
+        ('length', '<u2'),
+    ])
+
+
+def pack_states(states) -> np.ndarray:
+    if isinstance(states, torch.Tensor):
+        states = states.numpy()
+    return np.packbits(np.asarray(states) != 0, axis=-1, bitorder='little')
+
+
+def unpack_states(packed: np.ndarray, state_size: int) -> np.ndarray:
+    return np.unpackbits(packed, axis=-1, count=state_size, bitorder='little')
+
+
+def make_header(game, seed: int = None) -> np.ndarray:
+    header = np.zeros((), dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['game'] = type(game).__name__.encode()
+    header['state_version'] = game.STATE_VERSION
+    header['state_size'] = game.state_size
+    header['width'] = game.grid.width
+    header['height'] = game.grid.height
+    header['x0'] = getattr(game, 'x0', 0)
+    header['y0'] = getattr(game, 'y0', 0)
+    header['walls'] = getattr(game, 'walls', False)
+    header['seed'] = -1 if seed is None else seed
+    return header
+
+
+def read_header(path: str) -> np.ndarray:
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE or not raw.startswith(MAGIC):
+        raise ValueError(f"{path} is not a trajectory file")
+    header = np.frombuffer(raw[:HEADER_DTYPE.itemsize], dtype=HEADER_DTYPE)[0]
+    if header['version'] != VERSION:
+        raise ValueError(f"{path} has trajectory format version {header['version']}, expected {VERSION}")
+    return header
+
+
+class TrajectoryWriter:
+    # Appends transitions to a trajectory file, buffering buffer_size records between writes.
+
+    def __init__(self, path: str, game, seed: int = None, buffer_size: int = 4096):
+        self.path = path
+        self.header = make_header(game, seed)
+        self.dtype = record_dtype(game.state_size)
+
+        if os.path.exists(path) and os.path.getsize(path):
+            existing = read_header(path)
+            for field in COMPATIBLE_FIELDS:
+                if existing[field] != self.header[field]:
+                    raise ValueError(f"Can not append to {path}, its {field} is {existing[field]} not {self.header[field]}")
+            self.file = open(path, 'ab')
+            # drop a record torn by a crash so that the new ones stay aligned
+            self.file.truncate(HEADER_SIZE + (os.path.getsize(path) - HEADER_SIZE)//self.dtype.itemsize*self.dtype.itemsize)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(self.header.tobytes().ljust(HEADER_SIZE, b'\x00'))
+
+        self.buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self.columns = [self.buffer[name] for name in self.dtype.names]
+        self.n = 0
+
+    def append(self, state, action: int, reward: float, next_state, game_over: bool, last: bool, trace: Tuple[int, ...]) -> None:
+        head_x, head_y, food_x, food_y, length = trace
+        states, next_states, actions, dones, lasts, rewards, heads, foods, lengths = self.columns
+        n = self.n
+        states[n] = pack_states(state)
+        next_states[n] = pack_states(next_state)
+        actions[n] = action
+        dones[n] = game_over
+        lasts[n] = last or game_over
+        rewards[n] = reward
+        heads[n] = head_x, head_y
+        foods[n] = food_x, food_y
+        lengths[n] = length
+        self.n = n + 1
+        if self.n == len(self.buffer):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.n:
+            self.file.write(self.buffer[:self.n].tobytes())
+            self.n = 0
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    # Memory-maps a trajectory file, sample and get return batches the way ReplayBuffer does,
+    # so the file can stand in for GameAgent.memory without being loaded into RAM.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header = read_header(path)
+        self.state_size = int(self.header['state_size'])
+        self.dtype = record_dtype(self.state_size)
+        self.refresh()
+
+    def refresh(self) -> None:
+        # picks up records appended since the file was opened
+        n = (os.path.getsize(self.path) - HEADER_SIZE)//self.dtype.itemsize
+        if n > 0:
+            self.records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def sample_idxs(self, batch_size: int) -> np.ndarray:
+        if len(self) <= batch_size:
+            return np.arange(len(self))
+        # sorted so that a batch reads the file front to back
+        return np.sort(np.random.randint(0, len(self), size=batch_size))
+
+    def sample(self, batch_size: int):
+        return self.get(self.sample_idxs(batch_size))
+
+    def get(self, idxs: np.ndarray):
+        records = self.records[idxs]
+        return (
+            torch.from_numpy(unpack_states(records['state'], self.state_size)).float(),
+            torch.from_numpy(records['action']).long(),
+            torch.from_numpy(records['reward'].copy()),
+            torch.from_numpy(unpack_states(records['next_state'], self.state_size)).float(),
+            torch.from_numpy(records['done'].astype(bool)),
+        )
+
+    def episodes(self) -> np.ndarray:
+        # (start, stop) record ranges, a trailing unfinished episode is included
+        stops = np.flatnonzero(self.records['last']) + 1
+        if not len(stops) or stops[-1] != len(self):
+            stops = np.append(stops, len(self))
+        starts = np.concatenate([[0], stops[:-1]])
+        return np.stack([starts, stops], axis=1)
+
+
+DIRECTIONS = ('up', 'down', 'left', 'right')
+
+
+def episode_frames(reader: TrajectoryReader, start: int, stop: int) -> Iterator[Tuple[list, tuple, str, int]]:
+    # Rebuilds the Snake board before the first step and after every step of an episode,
+    # as (body, food, direction, score). The body after a step is the last `length` cells the head went through.
+    header = reader.header
+    width = int(header['width'])
+    records = reader.records[start:stop]
+    if not len(records):
+        return
+
+    x0, y0 = int(header['x0']), int(header['y0'])
+    initial_length = int(records[0]['length'])
+    cells = [(x0 - i % width, y0) for i in range(initial_length)][::-1]
+    direction = DIRECTIONS[int(np.argmax(unpack_states(records[0]['state'], reader.state_size)[:4]))]
+    yield cells, None, direction, 0
+
+    score = 0
+    for record in records:
+        cells.append(tuple(record['head'].tolist()))
+        length = int(record['length'])
+        score += record['reward'] > 0
+        food = tuple(record['food'].tolist()) if record['food'][0] >= 0 else None
+        direction = DIRECTIONS[int(np.argmax(unpack_states(record['next_state'], reader.state_size)[:4]))]
+        yield cells[-length:], food, direction, score
+
+
+def replay(path: str, episode: int = 0, fps: float = 10., stream=None) -> None:
+    reader = TrajectoryReader(path)
+    header = reader.header
+    if header['game'] != b'Snake':
+        raise ValueError(f"Can only replay Snake trajectories, {path} holds {header['game'].decode()}")
+
+    episodes = reader.episodes()
+    episode = range(len(episodes))[episode]
+    start, stop = episodes[episode]
+    width, height = int(header['width']), int(header['height'])
+    game = Snake((width, height), int(header['x0']), int(header['y0']), 1, walls=bool(header['walls']))
+
+    for step, (body, food, direction, score) in enumerate(episode_frames(reader, start, stop)):
+        # segments outside the grid are the initial body still off screen or a head that hit a wall
+        body = [(x, y) for x, y in body if 0 <= x < width and 0 <= y < height]
+        if not body:
+            continue
+        game.set_body(body)
+        game.direction = direction
+        game.to_eat = [food] if food else []
+        game.eating = []
+        game.HEADER = f"Episode {episode}/{len(episodes) - 1} - Step {step}/{stop - start} - Score: {score}"
+        game.grid.print(game, stream)
+        if fps:
+            time.sleep(1/fps)
+    (stream or sys.stdout).write('\n')
+
+
+def info(path: str) -> None:
+    reader = TrajectoryReader(path)
+    header = reader.header
+    for field in HEADER_DTYPE.names[1:]:
+        value = header[field]
+        print(f"{field}: {value.decode() if isinstance(value, bytes) else value}")
+    episodes = reader.episodes()
+    scores = np.add.reduceat(reader.records['reward'] > 0, episodes[:, 0]) if len(reader) else np.zeros(0)
+    print(f"records: {len(reader)} ({reader.dtype.itemsize} bytes each)")
+    print(f"episodes: {len(episodes)}")
+    if len(scores):
+        print(f"mean score: {scores.mean():.2f}, record: {scores.max()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and replay trajectory files recorded by TrainableGame.train")
+    commands = parser.add_subparsers(dest='command', required=True)
+    info_parser = commands.add_parser('info', help="print the header and episode statistics")
+    info_parser.add_argument('path')
+    replay_parser = commands.add_parser('replay', help="replay an episode in the terminal")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('-e', '--episode', type=int, default=0, help="episode index, negative counts from the end")
+    replay_parser.add_argument('--fps', type=float, default=10.)
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        info(args.path)
+    else:
+        replay(args.path, args.episode, args.fps)
+
+
+if __name__ == "__main__":
+    main()
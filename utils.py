@@ -1,8 +1,10 @@
 import tty
 import sys
 import termios
-import matplotlib.pyplot as plt
-from IPython import display
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
 
 class Getch:
     def __init__(self):
@@ -24,10 +26,13 @@ getch = Getch()
 
 
 
-
-plt.ion()
-
 def plot_progress(scores, mean_scores):
+    # matplotlib and IPython are imported on first use, importing utils stays cheap
+    import matplotlib.pyplot as plt
+    from IPython import display
+
+    plt.style.use("dark_background")
+    plt.ion()
     display.clear_output(wait=True)
     display.display(plt.gcf())
     plt.clf()
@@ -40,4 +45,87 @@ def plot_progress(scores, mean_scores):
     plt.text(len(scores)-1, scores[-1], str(scores[-1]))
     plt.text(len(mean_scores)-1, mean_scores[-1], str(mean_scores[-1]))
     plt.show(block=False)
-    plt.pause(.1);
\ No newline at end of file
+    plt.pause(.1);
+
+
+class ProgressPlotter:
+    # Plots training progress from a separate process so that drawing never blocks training.
+    # The trainer only pushes scores into a queue, the plotter redraws at most fps times a second.
+
+    def __init__(self, fps: float = 2., max_points: int = 2000, path: str = None):
+        ctx = mp.get_context('spawn')
+        self.queue = ctx.Queue()
+        self.process = ctx.Process(target=run_plotter, args=(self.queue, fps, max_points, path), daemon=True)
+        self.process.start()
+
+    def push(self, score: float, mean_score: float) -> None:
+        self.queue.put_nowait((score, mean_score))
+
+    def close(self, timeout: float = 5.) -> None:
+        self.queue.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def decimate(values: np.ndarray, max_points: int):
+    step = max(1, -(-len(values) // max_points))
+    idxs = np.arange(0, len(values), step)
+    return idxs, values[idxs]
+
+
+def run_plotter(scores_queue, fps: float, max_points: int, path: str) -> None:
+    import matplotlib.pyplot as plt
+
+    plt.style.use("dark_background")
+    fig, ax = plt.subplots()
+    ax.set_title('Training...')
+    ax.set_xlabel('Number of Games')
+    ax.set_ylabel('Score')
+    score_line, = ax.plot([], [], 'r.', linestyle='none')
+    mean_line, = ax.plot([], [])
+    score_text = ax.text(0, 0, '')
+    mean_text = ax.text(0, 0, '')
+    plt.show(block=False)
+
+    scores = np.zeros(1024)
+    mean_scores = np.zeros(1024)
+    n = 0
+    dirty = False
+    running = True
+    next_draw = time.monotonic()
+    while running:
+        try:
+            item = scores_queue.get(timeout=max(0., next_draw - time.monotonic()))
+            if item is None:
+                running = False
+            else:
+                if n == len(scores):
+                    scores = np.resize(scores, 2*n)
+                    mean_scores = np.resize(mean_scores, 2*n)
+                scores[n], mean_scores[n] = item
+                n += 1
+                dirty = True
+        except queue.Empty:
+            pass
+
+        if dirty and (time.monotonic() >= next_draw or not running):
+            score_line.set_data(*decimate(scores[:n], max_points))
+            mean_line.set_data(*decimate(mean_scores[:n], max_points))
+            score_text.set_position((n-1, scores[n-1]))
+            score_text.set_text(f'{scores[n-1]:g}')
+            mean_text.set_position((n-1, mean_scores[n-1]))
+            mean_text.set_text(f'{mean_scores[n-1]:g}')
+            ax.relim()
+            ax.autoscale_view(scaley=False)
+            ax.set_ylim(0, 1.05*max(scores[:n].max(), mean_scores[:n].max(), 1))
+            fig.canvas.draw_idle()
+            if path:
+                fig.savefig(path)
+            dirty = False
+            next_draw = time.monotonic() + 1/fps
+        elif time.monotonic() >= next_draw:
+            next_draw = time.monotonic() + 1/fps
+        fig.canvas.flush_events()
+
+    plt.close(fig)